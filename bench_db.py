@@ -0,0 +1,89 @@
+"""Бенчмарк доступа к базе ПК: соединение на каждый запрос против общего соединения.
+
+Сравнивает три способа выполнить пару «проверить ПК + занять/освободить»:
+  • connect — как было: sqlite3.connect на каждый запрос, прямо в event loop;
+  • shared  — общее WAL-соединение из storage.py через поток БД (run_db);
+  • pool    — PcPool из utils.py: проверка в памяти, пакетная запись в базу.
+Печатает операций в секунду для каждого способа.
+
+Запуск: python bench_db.py [--ops 2000] [--dir /путь/к/диску]
+По умолчанию база во временном каталоге. Если он на tmpfs, fsync ничего не
+стоит; каталог на настоящем диске (--dir) показывает разницу честнее.
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--ops', type=int, default=2000, help='пар запросов на способ')
+parser.add_argument('--pcs', type=int, default=50)
+parser.add_argument('--dir', help='каталог для временных баз')
+args = parser.parse_args()
+
+workdir = tempfile.mkdtemp(dir=args.dir)
+os.environ['DB_PATH'] = os.path.join(workdir, 'bench_db.db')
+
+from storage import get_db_connection, run_db
+from utils import pc_pool
+
+CONNECT_DB = os.path.join(workdir, 'bench_connect.db')
+
+def prepare_connect_db():
+    conn = sqlite3.connect(CONNECT_DB)
+    conn.execute('CREATE TABLE IF NOT EXISTS pc_list (id INTEGER PRIMARY KEY, is_available BOOLEAN DEFAULT TRUE)')
+    conn.executemany('INSERT OR REPLACE INTO pc_list (id, is_available) VALUES (?, TRUE)',
+                     [(pc_id,) for pc_id in range(1, args.pcs + 1)])
+    conn.commit()
+    conn.close()
+
+async def bench_connect(ops: int) -> float:
+    """Как до общего соединения: отдельное подключение на каждый запрос"""
+    prepare_connect_db()
+    started = time.perf_counter()
+    for i in range(ops):
+        pc_id = i % args.pcs + 1
+        conn = sqlite3.connect(CONNECT_DB)
+        (is_available,) = conn.execute('SELECT is_available FROM pc_list WHERE id = ?', (pc_id,)).fetchone()
+        conn.close()
+        conn = sqlite3.connect(CONNECT_DB)
+        conn.execute('UPDATE pc_list SET is_available = ? WHERE id = ?', (not is_available, pc_id))
+        conn.commit()
+        conn.close()
+    return ops / (time.perf_counter() - started)
+
+def _toggle(pc_id: int):
+    conn = get_db_connection()
+    (is_available,) = conn.execute('SELECT is_available FROM pc_list WHERE id = ?', (pc_id,)).fetchone()
+    with conn:
+        conn.execute('UPDATE pc_list SET is_available = ? WHERE id = ?', (not is_available, pc_id))
+
+async def bench_shared(ops: int) -> float:
+    """Общее WAL-соединение, запросы в потоке БД"""
+    pc_pool.add(args.pcs)
+    await pc_pool.flush()
+    started = time.perf_counter()
+    for i in range(ops):
+        await run_db(_toggle, i % args.pcs + 1)
+    return ops / (time.perf_counter() - started)
+
+async def bench_pool(ops: int) -> float:
+    """PcPool: состояние в памяти, в базу уходит одна пачка изменений"""
+    started = time.perf_counter()
+    for i in range(ops):
+        pc_id = i % args.pcs + 1
+        if not pc_pool.reserve(pc_id):
+            pc_pool.release(pc_id)
+    await pc_pool.flush()
+    return ops / (time.perf_counter() - started)
+
+async def main():
+    print(f"База: {workdir}, пар запросов: {args.ops}")
+    for name, bench in (('connect', bench_connect), ('shared', bench_shared), ('pool', bench_pool)):
+        rate = await bench(args.ops)
+        print(f"{name:8} {rate:12.0f} операций/с")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+"""Замер задержки state.get_data / state.update_data для MemoryStorage и SQLiteStorage.
+
+Запуск: python bench_fsm.py [количество операций]
+Использует временную базу, рабочая pc_database.db не затрагивается.
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'bench_fsm.db')
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from fsm_storage import SQLiteStorage
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+async def measure(storage, count: int) -> dict:
+    timings = {'get_data': [], 'update_data': []}
+    for i in range(count):
+        # Разные пользователи, как при потоке переименований в одной группе
+        key = StorageKey(bot_id=1, chat_id=-100, user_id=i % 500, thread_id=i % 50)
+        state = FSMContext(storage=storage, key=key)
+
+        started = time.perf_counter()
+        await state.update_data(topic_id=i, old_name=f"{i}:Без названия")
+        timings['update_data'].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await state.get_data()
+        timings['get_data'].append(time.perf_counter() - started)
+    return timings
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for name, storage in (('MemoryStorage', MemoryStorage()), ('SQLiteStorage', SQLiteStorage())):
+        timings = await measure(storage, count)
+        started = time.perf_counter()
+        await storage.close()
+        close_ms = (time.perf_counter() - started) * 1000
+        for operation, values in timings.items():
+            print(
+                f"{name:14} {operation:12} p50 {percentile(values, 0.5) * 1e6:6.1f} мкс  "
+                f"p99 {percentile(values, 0.99) * 1e6:6.1f} мкс"
+            )
+        print(f"{name:14} запись на диск при закрытии: {close_ms:.1f} мс")
+
+if __name__ == '__main__':
+    asyncio.run(main())
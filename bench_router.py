@@ -0,0 +1,266 @@
+"""Офлайн-бенчмарк роутера: прогон потока обновлений через настоящий Dispatcher.
+
+Бот работает с заглушкой сессии, которая не ходит в сеть, а отвечает
+правдоподобными объектами и считает вызовы Bot API. Поток обновлений
+синтетический (или записанный, --updates) и включает обычную переписку в
+темах, SOS-слова, ограниченные темы, переименование тем с выбором ПК и
+тикеты поддержки.
+
+Печатает обновлений в секунду, перцентили задержки по обработчикам и число
+вызовов Bot API на обновление. С --max-p99-ms / --min-rate возвращает код 1,
+если порог нарушен, — для проверки регрессий в CI.
+
+Запуск: python bench_router.py [--cycles 50] [--updates recorded.jsonl]
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import logging
+import tempfile
+from collections import Counter, defaultdict
+
+# Временная база и снятые лимиты — до импорта модулей бота
+os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'bench_router.db')
+os.environ['ADMIN_ID'] = '0'
+os.environ.pop('WEBHOOK_URL', None)
+
+import config
+
+config.OUTBOX_GLOBAL_RATE = 1e9
+config.OUTBOX_GROUP_LIMITS = {family: (1e9, 1e9, 1e9, 1e9) for family in config.OUTBOX_GROUP_LIMITS}
+config.OUTBOX_PRIVATE_LIMITS = (1e9, 1e9, 1e9, 1e9)
+config.DASHBOARD_EDIT_INTERVAL = 0
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Update
+
+from config import topics_dict, workers_dict, rename_topics_dict, restricted_topics
+from handlers import router
+from fsm_storage import SQLiteStorage, RenameSession
+from utils import pc_pool, sos_expiry, stop_dashboard_ticker, background_tasks
+
+BOT_ID = 42
+CHAT_ID = -1001000000001
+CHAT = {'id': CHAT_ID, 'type': 'supergroup', 'title': 'Bench', 'is_forum': True, 'username': 'bench_forum'}
+BOT_USER = {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+ADMIN_USER = {'id': 1, 'is_bot': False, 'first_name': 'Admin', 'username': 'admin'}
+
+TOPICS = range(2, 52)  # обычные темы
+RESTRICTED_TOPIC = 60
+RENAME_TOPIC_BASE = 1000
+NAME_REQUEST_TEXT = "⚠️ Введите имя ответом на сообщение — это необходимо для присвоения названия теме."
+
+class RecordingSession(BaseSession):
+    """Сессия без сети: отвечает заглушками и считает вызовы по методам"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+        self._ids = itertools.count(100000)
+
+    def _result(self, method, name: str):
+        chat_id = getattr(method, 'chat_id', CHAT_ID)
+        chat = CHAT if chat_id == CHAT_ID else {'id': chat_id, 'type': 'private', 'first_name': 'user'}
+        if name in ('SendMessage', 'EditMessageText'):
+            return {
+                'message_id': next(self._ids), 'date': int(time.time()), 'chat': chat,
+                'from': BOT_USER, 'text': getattr(method, 'text', '') or ''
+            }
+        if name == 'CreateForumTopic':
+            return {'message_thread_id': next(self._ids), 'name': method.name, 'icon_color': 7322096}
+        if name == 'GetChatAdministrators':
+            return [{'status': 'creator', 'user': ADMIN_USER, 'is_anonymous': False}]
+        if name == 'GetChatMember':
+            return {'status': 'member', 'user': {'id': method.user_id, 'is_bot': False, 'first_name': 'user'}}
+        if name == 'GetMe':
+            return BOT_USER
+        return True
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] += 1
+        if name == 'GetChat':
+            # Обязательные поля ChatFullInfo меняются от версии к версии Bot API,
+            # обработчикам нужны только id, type, title, username и is_forum
+            return method.__returning__.model_construct(**CHAT)
+        content = json.dumps({'ok': True, 'result': self._result(method, name)})
+        response = self.check_response(bot=bot, method=method, status_code=200, content=content)
+        return response.result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+def user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}", 'username': f"user{user_id}"}
+
+class UpdateFactory:
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def message(self, from_user: dict, text: str, topic_id: int = None, chat: dict = CHAT,
+                reply_to: dict = None) -> dict:
+        message = {
+            'message_id': next(self._message_ids), 'date': int(time.time()),
+            'chat': chat, 'from': from_user, 'text': text
+        }
+        if topic_id:
+            message['message_thread_id'] = topic_id
+            message['is_topic_message'] = True
+        if reply_to:
+            message['reply_to_message'] = reply_to
+        return {'update_id': next(self._update_ids), 'message': message}
+
+    def callback(self, from_user: dict, data: str, topic_id: int = None, chat: dict = CHAT) -> dict:
+        message = self.message(BOT_USER, "меню", topic_id, chat)['message']
+        return {
+            'update_id': next(self._update_ids),
+            'callback_query': {
+                'id': str(message['message_id']), 'from': from_user, 'chat_instance': '1',
+                'data': data, 'message': message
+            }
+        }
+
+def prepare_state(cycles: int):
+    """Темы, воркеры, ограничения, темы для переименования и ПК для потока"""
+    topics_dict[CHAT_ID] = {topic_id: f"Тема {topic_id}" for topic_id in TOPICS}
+    workers_dict[CHAT_ID] = {topic_id: ['@worker1', '@worker2'] for topic_id in TOPICS[:10]}
+    topics_dict[CHAT_ID][RESTRICTED_TOPIC] = "Закрытая тема"
+    restricted_topics[CHAT_ID] = {RESTRICTED_TOPIC: ['@user7']}
+    rename_topics_dict[CHAT_ID] = set()
+    for i in range(cycles * 5):
+        topic_id = RENAME_TOPIC_BASE + i
+        topics_dict[CHAT_ID][topic_id] = f"{i + 1}:Без названия"
+        rename_topics_dict[CHAT_ID].add(topic_id)
+    pc_pool.add(cycles * 5)
+
+async def synthetic_stream(cycles: int, storage: SQLiteStorage):
+    """Один цикл — 100 обновлений: 60 сообщений в темах, 10 SOS, 10 в закрытой
+    теме, 5 переименований (подтверждение, имя, выбор ПК) и 5 тикетов поддержки"""
+    factory = UpdateFactory()
+    rename_index = 0
+    for cycle in range(cycles):
+        for i in range(60):
+            yield 'chatter', factory.message(user(100 + i % 30), f"обычное сообщение {cycle}-{i}", TOPICS[i % len(TOPICS)])
+        for i in range(10):
+            yield 'sos', factory.message(user(200 + i), "срочно нужен номер", TOPICS[(cycle + i) % len(TOPICS)])
+        for i in range(10):
+            # Половина пишет user7, которому тема разрешена, остальные удаляются
+            author = user(7) if i % 2 else user(300 + i)
+            yield 'restricted', factory.message(author, "сообщение в закрытой теме", RESTRICTED_TOPIC)
+        for i in range(5):
+            topic_id = RENAME_TOPIC_BASE + rename_index
+            rename_index += 1
+            worker = user(400 + rename_index)
+            yield 'rename', factory.callback(worker, f'confirm_rename_{topic_id}', topic_id)
+
+            key = StorageKey(bot_id=BOT_ID, chat_id=CHAT_ID, user_id=worker['id'])
+            session = RenameSession.from_data((await storage.get_data(key)).get(RenameSession.KEY))
+            reply_to = {
+                'message_id': session.request_name_message_id or 0, 'date': int(time.time()),
+                'chat': CHAT, 'from': BOT_USER, 'text': NAME_REQUEST_TEXT
+            }
+            yield 'rename', factory.message(worker, f"Работник {rename_index}", topic_id, reply_to=reply_to)
+            yield 'rename', factory.callback(worker, f'select_pc_{rename_index}', topic_id)
+        for i in range(5):
+            customer = user(500 + cycle * 5 + i)
+            private = {'id': customer['id'], 'type': 'private', 'first_name': customer['first_name']}
+            yield 'support', factory.callback(customer, 'support', chat=private)
+            yield 'support', factory.message(customer, "Не работает бот, помогите", chat=private)
+
+async def recorded_stream(path: str):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield 'recorded', json.loads(line)
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cycles', type=int, default=50, help='циклов по 100 обновлений')
+    parser.add_argument('--updates', help='файл с записанными обновлениями (JSON в строке)')
+    parser.add_argument('--max-p99-ms', type=float, help='порог p99 задержки любого обработчика')
+    parser.add_argument('--min-rate', type=float, help='порог обновлений в секунду')
+    args = parser.parse_args()
+
+    # Логи обработчиков на каждое сообщение заглушили бы результат
+    logging.disable(logging.INFO)
+
+    session = RecordingSession()
+    bot = Bot(token=f"{BOT_ID}:BENCH", session=session)
+    storage = SQLiteStorage()
+    dp = Dispatcher(storage=storage)
+    dp.include_router(router)
+
+    handler_times = defaultdict(list)
+
+    async def measure_handler(handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_times[data['handler'].callback.__name__].append(time.perf_counter() - started)
+
+    dp.message.middleware(measure_handler)
+    dp.callback_query.middleware(measure_handler)
+
+    prepare_state(args.cycles)
+    stream = recorded_stream(args.updates) if args.updates else synthetic_stream(args.cycles, storage)
+
+    kinds = Counter()
+    update_times = []
+    started = time.perf_counter()
+    async for kind, data in stream:
+        update = Update.model_validate(data, context={'bot': bot})
+        update_started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        update_times.append(time.perf_counter() - update_started)
+        kinds[kind] += 1
+    elapsed = time.perf_counter() - started
+
+    # Фоновые задачи (уведомления воркеров, дашборд) тоже делают вызовы API
+    while background_tasks:
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+    await asyncio.sleep(0.1)
+    sos_expiry.stop()
+    stop_dashboard_ticker()
+    await storage.close()
+
+    total = len(update_times)
+    calls = sum(session.calls.values())
+    print(f"Обновлений: {total} ({', '.join(f'{kind} {count}' for kind, count in kinds.items())})")
+    print(f"Скорость: {total / elapsed:.0f} обновлений/с, "
+          f"p50 {percentile(update_times, 0.5) * 1000:.2f} мс, p99 {percentile(update_times, 0.99) * 1000:.2f} мс")
+    print(f"Вызовов Bot API: {calls} ({calls / total:.2f} на обновление)")
+    for method, count in session.calls.most_common():
+        print(f"  {method:24} {count:6}  {count / total:.3f} на обновление")
+    print("Задержка обработчиков:")
+    worst_p99 = 0.0
+    for name, values in sorted(handler_times.items(), key=lambda item: -len(item[1])):
+        p99 = percentile(values, 0.99) * 1000
+        worst_p99 = max(worst_p99, p99)
+        print(f"  {name:28} n={len(values):6}  p50 {percentile(values, 0.5) * 1000:7.3f} мс  "
+              f"p90 {percentile(values, 0.9) * 1000:7.3f} мс  p99 {p99:7.3f} мс")
+
+    failed = False
+    if args.max_p99_ms is not None and worst_p99 > args.max_p99_ms:
+        print(f"РЕГРЕССИЯ: p99 {worst_p99:.3f} мс больше порога {args.max_p99_ms} мс")
+        failed = True
+    if args.min_rate is not None and total / elapsed < args.min_rate:
+        print(f"РЕГРЕССИЯ: {total / elapsed:.0f} обновлений/с меньше порога {args.min_rate}")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,100 @@
+"""Микробенчмарк поиска SOS-слов: прежний цикл `word in text` против SosMatcher.
+
+Корпус — синтетическая переписка в темах (или свои сообщения, --corpus,
+по одному в строке), около 2% сообщений с SOS-словом. Список слов — общий
+список по умолчанию плюс сгенерированные слова, как после многих /gadd.
+Для каждого размера списка печатает время на сообщение для цикла,
+матчера и матчера в режиме целых слов, а также время пересборки матчера
+после /gadd. Заодно проверяет, что цикл и матчер находят SOS в одних и
+тех же сообщениях.
+
+Запуск: python bench_sos.py [--messages 20000] [--corpus messages.txt]
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'bench_sos.db')
+
+from config import sos_words
+from utils import SosMatcher
+
+PHRASES = [
+    "привет, кто сегодня на смене", "ок, понял", "скинь ссылку на таблицу", "через 10 минут буду",
+    "у меня всё работает", "перезагрузил пк, жду", "кто свободен?", "готово, проверьте пожалуйста",
+    "спасибо!", "не грузит страницу", "отошёл на перерыв", "вернулся", "сколько ещё ждать?",
+    "норм, продолжаю", "👍", "завтра выхожу с утра", "а где инструкция?", "сделал, отпишитесь",
+    "кто-нибудь видел админа", "снова вылетело приложение, переподключаюсь"
+]
+SOS_PHRASES = ["нужен номер", "срочно номер в тему", "дайте номер пожалуйста", "номер закончился"]
+SYLLABLES = ["ка", "ро", "ми", "ст", "ве", "ло", "ну", "за", "пре", "ол", "ти", "ск", "да", "мо"]
+
+def synthetic_corpus(count: int, rng: random.Random) -> list:
+    messages = []
+    for _ in range(count):
+        if rng.random() < 0.02:
+            text = rng.choice(SOS_PHRASES)
+        else:
+            text = " ".join(rng.choice(PHRASES) for _ in range(rng.randint(1, 3)))
+        messages.append(text.lower())
+    return messages
+
+def extra_words(count: int, rng: random.Random) -> set:
+    """Слова вида 'каромист', которых нет в корпусе, — как добавленные через /gadd"""
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 5))) + "щ")
+    return words
+
+def substring_loop(words, text: str):
+    # Так check_sos_word искал слова до SosMatcher
+    for word in words:
+        if word in text:
+            return word
+    return None
+
+def per_message_us(search, messages: list) -> tuple:
+    started = time.perf_counter()
+    hits = sum(1 for text in messages if search(text))
+    return (time.perf_counter() - started) / len(messages) * 1e6, hits
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--corpus', help='файл с сообщениями, по одному в строке')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[0, 20, 100, 500],
+                        help='сколько слов добавить к общему списку')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    if args.corpus:
+        with open(args.corpus, encoding='utf-8') as f:
+            messages = [line.strip().lower() for line in f if line.strip()]
+    else:
+        messages = synthetic_corpus(args.messages, rng)
+
+    print(f"Сообщений: {len(messages)}")
+    print(f"{'слов':>6} {'цикл':>12} {'матчер':>12} {'целые слова':>12} {'пересборка':>12}")
+    failed = False
+    for size in args.sizes:
+        words = set(sos_words) | extra_words(size, rng)
+        loop_us, loop_hits = per_message_us(lambda text: substring_loop(words, text), messages)
+        matcher = SosMatcher(words)
+        matcher_us, matcher_hits = per_message_us(matcher.search, messages)
+        boundary_us, _ = per_message_us(SosMatcher(words, word_boundary=True).search, messages)
+
+        started = time.perf_counter()
+        matcher.add("новоеслово")
+        rebuild_ms = (time.perf_counter() - started) * 1000
+
+        print(f"{len(words):>6} {loop_us:>9.2f} мкс {matcher_us:>9.2f} мкс {boundary_us:>9.2f} мкс "
+              f"{rebuild_ms:>9.2f} мс")
+        if loop_hits != matcher_hits:
+            print(f"ОШИБКА: цикл нашёл SOS в {loop_hits} сообщениях, матчер — в {matcher_hits}")
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
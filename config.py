@@ -2,6 +2,7 @@
 import os
 import logging
 import pytz
+from collections import Counter
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,6 +10,24 @@ load_dotenv()
 # Bot configuration
 TOKEN = os.getenv('TELEGRAM_TOKEN')
 ADMIN_ID = int(os.getenv('ADMIN_ID', '0'))
+# 1 — SOS-слово должно быть отдельным словом ("номера" не срабатывает на "номер")
+SOS_WORD_BOUNDARY = os.getenv('SOS_WORD_BOUNDARY', '0') == '1'
+DB_PATH = os.getenv('DB_PATH', 'pc_database.db')
+
+# Webhook: если WEBHOOK_URL задан, бот принимает обновления через встроенный
+# aiohttp-сервер, иначе работает через long polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')  # внешний адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+# 1 — только для нагрузочных тестов: сервер отвечает на запрос после работы
+# обработчиков, и load_webhook.py измеряет их пропускную способность и задержки
+WEBHOOK_SYNC = os.getenv('WEBHOOK_SYNC', '0') == '1'
+
+# Адрес Bot API, если не api.telegram.org: локальный сервер Telegram или
+# fake_bot_api.py для нагрузочных тестов, например http://127.0.0.1:8081
+BOT_API_URL = os.getenv('BOT_API_URL', '').rstrip('/')
 
 # Logging configuration
 logging.basicConfig(
@@ -37,12 +56,11 @@ WAITING_FOR_ADMIN_RESPONSE = 15
 topics_dict = {}
 workers_dict = {}
 rename_topics_dict = {}
-sos_words = {"сос", "sos", "помогите", "помощь", "номер"}
+sos_words = {"сос", "sos", "помогите", "помощь", "номер"}  # общий список по умолчанию
+chat_sos_words = {}  # собственные списки SOS-слов чатов
 active_topics = {}
 active_topics_info = {}
 sos_activation_times = {}
-sos_removal_tasks = {}
-sos_update_tasks = {}
 restricted_topics = {}
 admin_list = set()
 breaks_dict = {}
@@ -53,5 +71,42 @@ pending_complaints = {}
 support_tickets = {}
 ticket_id_counter = 1
 
+# Кэши и счётчики
+CHAT_INFO_TTL = 300  # секунд хранится информация о чате
+ADMIN_ROSTER_TTL = 300  # секунд хранится список администраторов чата
+USERNAME_RETRY_BASE = 60  # через сколько секунд повторять поиск неизвестного username
+USERNAME_RETRY_MAX = 3600
+WORKER_NOTIFY_CONCURRENCY = 5  # одновременных отправок уведомлений воркерам
+SOS_AUTO_REMOVE_DELAY = 300  # SOS снимается автоматически через 5 минут
+DASHBOARD_EDIT_INTERVAL = 3.0  # не чаще одной правки 'Активных тем' за столько секунд
+SOS_REFRESH_INTERVAL = 30  # раз в столько секунд обновляется время простоя
+DASHBOARD_TICKER_MAX_RATE = 10  # не больше стольких плановых обновлений в секунду на все чаты
+DASHBOARD_SHARD_LIMIT = 4000  # длина одной части 'Активных тем' (лимит Telegram — 4096)
+DASHBOARD_CONTINUATION = "Темы в которых нужен номер (продолжение):\n"
+
+# Лимиты исходящих запросов к Bot API
+OUTBOX_GLOBAL_RATE = 30  # запросов в секунду на всего бота
+# Начальные лимиты чата по семействам методов, запросов в секунду:
+# (начальная частота, минимум, максимум, запас). Дальше частота подстраивается
+# под ответы Telegram: растёт после удачных запросов и падает после RetryAfter
+OUTBOX_GROUP_LIMITS = {
+    'message': (20 / 60, 1 / 60, 1, 20),  # sendMessage
+    'edit': (1, 1 / 60, 3, 5),  # editMessageText, deleteMessage
+    'topic': (20 / 60, 1 / 60, 1, 3),  # createForumTopic, editForumTopic, deleteForumTopic
+}
+OUTBOX_PRIVATE_LIMITS = (1, 1 / 60, 2, 3)  # личные чаты, все методы
+AIMD_INCREASE = 0.01  # запросов в секунду прибавляется после каждого удачного запроса
+AIMD_DECREASE = 0.5  # во сколько раз падает частота после RetryAfter
+OUTBOX_MAX_RETRIES = 3  # повторов после TelegramRetryAfter
+BULK_MAX_RETRIES = 20  # массовые операции не бросают тему из-за flood control
+TOPIC_JOB_PROGRESS_INTERVAL = 5  # секунд между правками прогресса создания и удаления тем
+TOPIC_DELETE_CONCURRENCY = 5  # одновременных запросов deleteForumTopic
+STATE_FLUSH_DELAY = 0.5  # секунд копятся изменения состояния перед записью в базу
+chat_info_cache = {}
+chat_admins_cache = {}
+username_ids = {}
+username_misses = {}
+bot_stats = Counter()
+
 # Timezone
 KYIV_TZ = pytz.timezone('Europe/Kiev')
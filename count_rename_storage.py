@@ -0,0 +1,175 @@
+"""Подсчёт операций с хранилищем FSM на каждом шаге переименования темы.
+
+Прогоняет через настоящий Dispatcher подтверждение темы, ответ с именем (в
+режиме выбора ПК) и выбор ПК. SQLiteStorage обёрнут в хранилище, которое
+считает вызовы. Отдельно считаются вызовы FSMContext из обработчиков.
+Учитываются только вызовы во время работы обработчика: get_state, который
+делает сам Dispatcher для фильтров по состоянию, в счёт не входит.
+
+Ожидается по шагам (FSMContext / хранилище):
+    подтверждение  get_data, set_data, set_state           3 / 3
+    имя            get_data, set_data, set_state           3 / 3
+    выбор ПК       get_data, clear                         2 / 3
+clear() в aiogram — это set_state(None) и set_data({}), поэтому в хранилище
+на последнем шаге три вызова. Данные сессии на каждом шаге читаются
+ровно один раз. При расхождении скрипт возвращает код 1.
+
+Запуск: python count_rename_storage.py [--renames 20]
+"""
+import time
+import asyncio
+import argparse
+import logging
+from collections import Counter
+
+# bench_router до импорта модулей бота подменяет базу на временную и снимает лимиты outbox
+from bench_router import (
+    RecordingSession, UpdateFactory, BOT_ID, CHAT_ID, CHAT, BOT_USER, NAME_REQUEST_TEXT, user
+)
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.types import Update
+
+from config import topics_dict, rename_topics_dict
+from handlers import router
+from fsm_storage import SQLiteStorage, RenameSession
+from utils import pc_pool, sos_expiry, stop_dashboard_ticker, background_tasks
+
+TOPIC_BASE = 1000
+EXPECTED = {
+    'handle_rename_confirmation': (3, 3),
+    'rename_topic': (3, 3),
+    'handle_pc_selection': (2, 3),
+}
+FSM_METHODS = ('get_state', 'set_state', 'get_data', 'set_data', 'update_data', 'get_value', 'clear')
+
+class CountingStorage(BaseStorage):
+    """Хранилище-обёртка: считает вызовы и передаёт их SQLiteStorage"""
+
+    def __init__(self, inner: SQLiteStorage):
+        self.inner = inner
+        self.calls = Counter()
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        self.calls['set_state'] += 1
+        await self.inner.set_state(key, state)
+
+    async def get_state(self, key: StorageKey):
+        self.calls['get_state'] += 1
+        return await self.inner.get_state(key)
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        self.calls['set_data'] += 1
+        await self.inner.set_data(key, data)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        self.calls['get_data'] += 1
+        return await self.inner.get_data(key)
+
+    async def close(self) -> None:
+        await self.inner.close()
+
+def count_fsm_calls(counter: Counter):
+    """Считать вызовы методов FSMContext (уровень, на котором работают обработчики).
+
+    Вложенные вызовы не считаются: clear() сам вызывает set_state и set_data.
+    """
+    depth = [0]
+    for name in FSM_METHODS:
+        original = getattr(FSMContext, name)
+
+        async def wrapper(self, *args, __name=name, __original=original, **kwargs):
+            if not depth[0]:
+                counter[__name] += 1
+            depth[0] += 1
+            try:
+                return await __original(self, *args, **kwargs)
+            finally:
+                depth[0] -= 1
+
+        setattr(FSMContext, name, wrapper)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--renames', type=int, default=20)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    storage = CountingStorage(SQLiteStorage())
+    fsm_calls = Counter()
+    count_fsm_calls(fsm_calls)
+
+    bot = Bot(token=f"{BOT_ID}:COUNT", session=RecordingSession())
+    dp = Dispatcher(storage=storage)
+    dp.include_router(router)
+
+    steps = []  # (обработчик, вызовы FSMContext, вызовы хранилища)
+
+    async def count_handler(handler, event, data):
+        fsm_calls.clear()
+        storage.calls.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            steps.append((data['handler'].callback.__name__, Counter(fsm_calls), Counter(storage.calls)))
+
+    dp.message.middleware(count_handler)
+    dp.callback_query.middleware(count_handler)
+
+    topics_dict[CHAT_ID] = {}
+    rename_topics_dict[CHAT_ID] = set()
+    for i in range(args.renames):
+        topics_dict[CHAT_ID][TOPIC_BASE + i] = f"{i + 1}:Без названия"
+        rename_topics_dict[CHAT_ID].add(TOPIC_BASE + i)
+    pc_pool.add(args.renames)
+
+    factory = UpdateFactory()
+
+    async def feed(data: dict):
+        await dp.feed_update(bot, Update.model_validate(data, context={'bot': bot}))
+
+    for i in range(args.renames):
+        topic_id = TOPIC_BASE + i
+        worker = user(20000 + i)
+        await feed(factory.callback(worker, f'confirm_rename_{topic_id}', topic_id))
+
+        key = StorageKey(bot_id=BOT_ID, chat_id=CHAT_ID, user_id=worker['id'])
+        session = RenameSession.from_data((await storage.inner.get_data(key)).get(RenameSession.KEY))
+        reply_to = {
+            'message_id': session.request_name_message_id or 0, 'date': int(time.time()),
+            'chat': CHAT, 'from': BOT_USER, 'text': NAME_REQUEST_TEXT
+        }
+        await feed(factory.message(worker, f"Работник {i + 1}", topic_id, reply_to=reply_to))
+        await feed(factory.callback(worker, f'select_pc_{i + 1}', topic_id))
+
+    while background_tasks:
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+    sos_expiry.stop()
+    stop_dashboard_ticker()
+    await storage.close()
+
+    errors = []
+    seen = Counter()
+    for name, fsm, raw in steps:
+        seen[name] += 1
+        expected_fsm, expected_raw = EXPECTED[name]
+        if sum(fsm.values()) != expected_fsm or sum(raw.values()) != expected_raw or raw['get_data'] != 1:
+            errors.append(f"{name}: FSMContext {dict(fsm)}, хранилище {dict(raw)}")
+
+    for name, (expected_fsm, expected_raw) in EXPECTED.items():
+        print(f"{name:28} шагов {seen[name]:4}  ожидается FSMContext {expected_fsm}, хранилище {expected_raw}")
+    renamed = sum(1 for name in topics_dict[CHAT_ID].values() if '#ПК' in name)
+    print(f"Переименовано тем: {renamed} из {args.renames}")
+    if renamed != args.renames or any(seen[name] != args.renames for name in EXPECTED):
+        errors.append("не все переименования прошли все три шага")
+    for error in errors[:10]:
+        print(f"ОШИБКА: {error}")
+    if not errors:
+        print("OK: число операций с хранилищем на каждом шаге совпадает с ожидаемым")
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    raise SystemExit(asyncio.run(main()))
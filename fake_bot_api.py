@@ -0,0 +1,473 @@
+"""Локальная замена Telegram Bot API для нагрузочных и интеграционных тестов.
+
+Реализует методы, которыми пользуется бот (темы форума, сообщения, сведения
+о чате и админах), хранит состояние форумов в памяти и отвечает 429 с
+retry_after, когда бот превышает лимиты чата или общий лимит бота — так
+можно проверить очередь исходящих запросов, рассылки, массовое создание и
+удаление тем без настоящего Telegram.
+
+Запуск:
+    python fake_bot_api.py --port 8081
+    BOT_API_URL=http://127.0.0.1:8081 python main.py
+
+Лимиты задаются как "запросов/секунд", например --topic-rate 20/60.
+Обновления для бота кладутся POST-запросом с JSON (одно обновление или
+список) на /updates: бот получит их через getUpdates или, если он
+работает через webhook, они будут отправлены на его адрес. Счётчики
+вызовов и ответов 429 по методам — GET /stats и при остановке сервера.
+"""
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+from config import ADMIN_ID
+from outbox import TokenBucket
+
+# Семейства методов, к которым применяется лимит чата (как в outbox)
+METHOD_FAMILIES = {
+    'sendmessage': 'message',
+    'editmessagetext': 'edit',
+    'deletemessage': 'edit',
+    'createforumtopic': 'topic',
+    'editforumtopic': 'topic',
+    'deleteforumtopic': 'topic',
+}
+# Служебные методы не расходуют общий лимит бота
+UNLIMITED_METHODS = {'getme', 'getupdates', 'setwebhook', 'deletewebhook', 'getwebhookinfo', 'close', 'logout'}
+
+GENERAL_TOPIC_ID = 1
+TOPIC_COLORS = [7322096, 16766590, 13338331, 9367192, 16749490, 16478047]
+
+class ApiError(Exception):
+    def __init__(self, code: int, description: str, parameters: dict = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.parameters = parameters
+
+def bad_request(description: str) -> ApiError:
+    return ApiError(400, f"Bad Request: {description}")
+
+def parse_rate(value: str) -> tuple:
+    """'20/60' -> (20, 60): не больше 20 запросов за 60 секунд"""
+    count, _, seconds = value.partition('/')
+    return float(count), float(seconds or 1)
+
+def user_json(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}", 'username': f"user{user_id}"}
+
+def bot_user_json(token: str) -> dict:
+    """Пользователь-бот; ID берётся из токена, как у настоящего Bot API"""
+    bot_id, _, _ = token.partition(':')
+    return {'id': int(bot_id) if bot_id.isdigit() else 42, 'is_bot': True,
+            'first_name': 'Fake bot', 'username': 'fake_bot'}
+
+class FakeChat:
+    """Чат с темами и сообщениями бота"""
+
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+        self.topics = {}    # message_thread_id -> {'name', 'icon_color'}
+        self.messages = {}  # message_id -> {'text', 'thread_id', 'reply_markup'}
+        self.next_message_id = 2  # 1 — General
+
+    @property
+    def is_forum(self) -> bool:
+        return self.id < 0
+
+    def to_json(self) -> dict:
+        if self.is_forum:
+            return {'id': self.id, 'type': 'supergroup', 'title': f"Forum {self.id}", 'is_forum': True}
+        return {'id': self.id, 'type': 'private', 'first_name': f"user{self.id}", 'username': f"user{self.id}"}
+
+    def new_message_id(self) -> int:
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        return message_id
+
+    def check_thread(self, thread_id: int):
+        if thread_id and thread_id != GENERAL_TOPIC_ID and thread_id not in self.topics:
+            raise bad_request("message thread not found")
+
+    def get_topic(self, thread_id: int) -> dict:
+        topic = self.topics.get(thread_id)
+        if topic is None:
+            raise bad_request("TOPIC_ID_INVALID")
+        return topic
+
+class FakeBotApi:
+    """Состояние поддельного Bot API: чаты, лимиты, очередь обновлений и счётчики"""
+
+    def __init__(self, args):
+        self.args = args
+        self.chats = {}
+        self.admins = args.admins
+        self.global_rate = parse_rate(args.global_rate)
+        self.group_rates = {
+            'message': parse_rate(args.message_rate),
+            'edit': parse_rate(args.edit_rate),
+            'topic': parse_rate(args.topic_rate),
+        }
+        self.private_rate = parse_rate(args.private_rate)
+        self._global = self._bucket(self.global_rate)
+        self._buckets = {}  # (chat_id, семейство) -> TokenBucket
+        self.updates = []
+        self._updates_event = asyncio.Event()
+        self.webhook_url = ''
+        self.webhook_secret = None
+        self.stats = Counter()
+        self.retry_afters = Counter()
+        self.errors = Counter()
+        self.bot_user = bot_user_json('')
+        self.methods = {
+            'getme': self.get_me,
+            'sendmessage': self.send_message,
+            'editmessagetext': self.edit_message_text,
+            'deletemessage': self.delete_message,
+            'createforumtopic': self.create_forum_topic,
+            'editforumtopic': self.edit_forum_topic,
+            'deleteforumtopic': self.delete_forum_topic,
+            'getchat': self.get_chat,
+            'getchatmember': self.get_chat_member,
+            'getchatadministrators': self.get_chat_administrators,
+            'answercallbackquery': self.answer_callback_query,
+            'setwebhook': self.set_webhook,
+            'deletewebhook': self.delete_webhook,
+            'getwebhookinfo': self.get_webhook_info,
+            'getupdates': self.get_updates,
+        }
+
+    @staticmethod
+    def _bucket(rate: tuple) -> TokenBucket:
+        count, seconds = rate
+        return TokenBucket(count / seconds, count)
+
+    def chat(self, params: dict) -> FakeChat:
+        try:
+            chat_id = int(params['chat_id'])
+        except (KeyError, ValueError):
+            raise bad_request("chat not found")
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            chat = self.chats[chat_id] = FakeChat(chat_id)
+        return chat
+
+    def forum(self, params: dict) -> FakeChat:
+        chat = self.chat(params)
+        if not chat.is_forum:
+            raise bad_request("the chat is not a forum")
+        return chat
+
+    def _take(self, bucket: TokenBucket):
+        """Списать токен или ответить 429, заблокировав ограничитель на retry_after"""
+        now = time.monotonic()
+        delay = bucket.delay(now)
+        if delay > 0:
+            retry_after = max(1, math.ceil(delay))
+            bucket.block(retry_after)
+            raise ApiError(429, f"Too Many Requests: retry after {retry_after}", {'retry_after': retry_after})
+        bucket.consume(now)
+
+    def check_limits(self, method: str, params: dict):
+        if method in UNLIMITED_METHODS:
+            return
+        family = METHOD_FAMILIES.get(method)
+        if family is not None and 'chat_id' in params:
+            chat = self.chat(params)
+            bucket = self._buckets.get((chat.id, family))
+            if bucket is None:
+                rate = self.group_rates[family] if chat.is_forum else self.private_rate
+                bucket = self._buckets[(chat.id, family)] = self._bucket(rate)
+            self._take(bucket)
+        self._take(self._global)
+
+    def message_json(self, chat: FakeChat, message_id: int) -> dict:
+        message = chat.messages[message_id]
+        result = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': chat.to_json(),
+            'from': self.bot_user,
+            'text': message['text'],
+        }
+        if message['thread_id']:
+            result['message_thread_id'] = message['thread_id']
+            result['is_topic_message'] = True
+        if message['reply_markup'] and 'inline_keyboard' in message['reply_markup']:
+            result['reply_markup'] = message['reply_markup']
+        return result
+
+    # --- Методы Bot API ---
+
+    def get_me(self, params: dict):
+        return dict(self.bot_user, can_join_groups=True, can_read_all_group_messages=True,
+                    supports_inline_queries=False)
+
+    def send_message(self, params: dict):
+        chat = self.chat(params)
+        thread_id = int(params.get('message_thread_id') or 0)
+        chat.check_thread(thread_id)
+        text = params.get('text') or ''
+        if not text.strip():
+            raise bad_request("message text is empty")
+        message_id = chat.new_message_id()
+        chat.messages[message_id] = {
+            'text': text,
+            'thread_id': thread_id,
+            'reply_markup': json_value(params.get('reply_markup'))
+        }
+        return self.message_json(chat, message_id)
+
+    def edit_message_text(self, params: dict):
+        chat = self.chat(params)
+        message = chat.messages.get(int(params.get('message_id') or 0))
+        if message is None:
+            raise bad_request("message to edit not found")
+        reply_markup = json_value(params.get('reply_markup'))
+        if message['text'] == params.get('text') and message['reply_markup'] == reply_markup:
+            raise bad_request("message is not modified: specified new message content and reply markup "
+                              "are exactly the same as a current content and reply markup of the message")
+        message['text'] = params.get('text') or ''
+        message['reply_markup'] = reply_markup
+        return self.message_json(chat, int(params['message_id']))
+
+    def delete_message(self, params: dict):
+        chat = self.chat(params)
+        if chat.messages.pop(int(params.get('message_id') or 0), None) is None:
+            raise bad_request("message to delete not found")
+        return True
+
+    def create_forum_topic(self, params: dict):
+        chat = self.forum(params)
+        name = params.get('name') or ''
+        if not 1 <= len(name) <= 128:
+            raise bad_request("TOPIC_TITLE_EMPTY" if not name else "TOPIC_TITLE_INVALID")
+        thread_id = chat.new_message_id()
+        icon_color = int(params.get('icon_color') or random.choice(TOPIC_COLORS))
+        chat.topics[thread_id] = {'name': name, 'icon_color': icon_color}
+        return {'message_thread_id': thread_id, 'name': name, 'icon_color': icon_color}
+
+    def edit_forum_topic(self, params: dict):
+        chat = self.forum(params)
+        topic = chat.get_topic(int(params.get('message_thread_id') or 0))
+        name = params.get('name')
+        if name is not None and name == topic['name']:
+            raise bad_request("TOPIC_NOT_MODIFIED")
+        if name is not None:
+            topic['name'] = name
+        return True
+
+    def delete_forum_topic(self, params: dict):
+        chat = self.forum(params)
+        thread_id = int(params.get('message_thread_id') or 0)
+        chat.get_topic(thread_id)
+        del chat.topics[thread_id]
+        chat.messages = {
+            message_id: message for message_id, message in chat.messages.items()
+            if message['thread_id'] != thread_id
+        }
+        return True
+
+    def get_chat(self, params: dict):
+        chat = self.chat(params)
+        return dict(
+            chat.to_json(),
+            accent_color_id=0,
+            max_reaction_count=11,
+            accepted_gift_types={
+                'unlimited_gifts': False,
+                'limited_gifts': False,
+                'unique_gifts': False,
+                'premium_subscription': False,
+                'gifts_from_channels': False
+            }
+        )
+
+    def _admin_json(self, user: dict) -> dict:
+        rights = [
+            'can_manage_chat', 'can_delete_messages', 'can_manage_video_chats', 'can_restrict_members',
+            'can_promote_members', 'can_change_info', 'can_invite_users', 'can_post_stories',
+            'can_edit_stories', 'can_delete_stories', 'can_pin_messages', 'can_manage_topics',
+            'can_send_welcome_messages'
+        ]
+        return dict({right: True for right in rights}, status='administrator', user=user,
+                    can_be_edited=False, is_anonymous=False)
+
+    def get_chat_member(self, params: dict):
+        chat = self.chat(params)
+        user_id = int(params.get('user_id') or 0)
+        if user_id == self.bot_user['id']:
+            return self._admin_json(self.bot_user)
+        if chat.is_forum and user_id in self.admins:
+            return self._admin_json(user_json(user_id))
+        return {'status': 'member', 'user': user_json(user_id)}
+
+    def get_chat_administrators(self, params: dict):
+        chat = self.forum(params)
+        admins = [self._admin_json(user_json(user_id)) for user_id in self.admins]
+        admins.append(self._admin_json(self.bot_user))
+        return admins
+
+    def answer_callback_query(self, params: dict):
+        return True
+
+    def set_webhook(self, params: dict):
+        self.webhook_url = params.get('url') or ''
+        self.webhook_secret = params.get('secret_token') or None
+        return True
+
+    def delete_webhook(self, params: dict):
+        self.webhook_url = ''
+        self.webhook_secret = None
+        if str(params.get('drop_pending_updates')).lower() == 'true':
+            self.updates.clear()
+        return True
+
+    def get_webhook_info(self, params: dict):
+        return {'url': self.webhook_url, 'has_custom_certificate': False, 'pending_update_count': len(self.updates)}
+
+    async def get_updates(self, params: dict):
+        if self.webhook_url:
+            raise ApiError(409, "Conflict: can't use getUpdates method while webhook is active; "
+                                "use deleteWebhook to delete the webhook first")
+        offset = int(params.get('offset') or 0)
+        if offset:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates:
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get('limit') or 100)
+        return self.updates[:limit]
+
+    # --- HTTP ---
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        token = request.match_info['token']
+        method = request.match_info['method']
+        handler = self.methods.get(method.lower())
+        self.stats[method] += 1
+        self.bot_user = bot_user_json(token)
+        try:
+            if handler is None:
+                raise ApiError(404, "Not Found: method not found")
+            params = await read_params(request)
+            if self.args.latency:
+                await asyncio.sleep(self.args.latency / 1000)
+            self.check_limits(method.lower(), params)
+            result = handler(params)
+            if asyncio.iscoroutine(result):
+                result = await result
+        except ApiError as e:
+            if e.code == 429:
+                self.retry_afters[method] += 1
+            else:
+                self.errors[method] += 1
+            body = {'ok': False, 'error_code': e.code, 'description': e.description}
+            if e.parameters:
+                body['parameters'] = e.parameters
+            return web.json_response(body, status=e.code)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def handle_updates(self, request: web.Request) -> web.Response:
+        """Положить обновления в очередь для бота (или сразу отправить на webhook)"""
+        data = await request.json()
+        updates = data if isinstance(data, list) else [data]
+        next_id = self.updates[-1]['update_id'] + 1 if self.updates else int(time.time())
+        for update in updates:
+            update.setdefault('update_id', next_id)
+            next_id = update['update_id'] + 1
+        if self.webhook_url:
+            await asyncio.gather(*(self.deliver(update) for update in updates))
+        else:
+            self.updates.extend(updates)
+            self._updates_event.set()
+        return web.json_response({'ok': True, 'result': len(updates)})
+
+    async def deliver(self, update: dict):
+        headers = {'X-Telegram-Bot-Api-Secret-Token': self.webhook_secret} if self.webhook_secret else {}
+        async with self.http.post(self.webhook_url, json=update, headers=headers) as response:
+            if response.status != 200:
+                self.errors['webhook'] += 1
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'calls': dict(self.stats),
+            'retry_after': dict(self.retry_afters),
+            'errors': dict(self.errors),
+            'chats': {
+                chat_id: {'topics': len(chat.topics), 'messages': len(chat.messages)}
+                for chat_id, chat in self.chats.items()
+            }
+        })
+
+    def print_stats(self):
+        print(f"{'Метод':<26}{'вызовов':>9}{'429':>7}{'ошибок':>8}")
+        for method, calls in self.stats.most_common():
+            print(f"{method:<26}{calls:>9}{self.retry_afters[method]:>7}{self.errors[method]:>8}")
+        for chat_id, chat in self.chats.items():
+            print(f"Чат {chat_id}: тем {len(chat.topics)}, сообщений {len(chat.messages)}")
+
+def json_value(value):
+    """Поле, которое aiogram передаёт строкой JSON (reply_markup и т.п.)"""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+    return value
+
+async def read_params(request: web.Request) -> dict:
+    """Параметры запроса: aiogram шлёт multipart-форму, другие клиенты — JSON или query string"""
+    params = dict(request.query)
+    if request.content_type == 'application/json':
+        params.update(await request.json())
+    elif request.can_read_body:
+        params.update({key: value for key, value in (await request.post()).items() if isinstance(value, str)})
+    return params
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--global-rate', default='30/1', help='общий лимит бота')
+    parser.add_argument('--message-rate', default='20/60', help='sendMessage в одну группу')
+    parser.add_argument('--edit-rate', default='60/60', help='editMessageText и deleteMessage в одной группе')
+    parser.add_argument('--topic-rate', default='20/60', help='создание, переименование и удаление тем в одной группе')
+    parser.add_argument('--private-rate', default='1/1', help='любые запросы в личный чат')
+    parser.add_argument('--latency', type=float, default=0, help='задержка ответа, мс')
+    parser.add_argument('--admins', type=int, nargs='*', default=[ADMIN_ID] if ADMIN_ID else [],
+                        help='ID администраторов групп (по умолчанию ADMIN_ID)')
+    args = parser.parse_args()
+
+    api = FakeBotApi(args)
+    app = web.Application()
+    app.router.add_route('*', '/bot{token}/{method}', api.handle_method)
+    app.router.add_post('/updates', api.handle_updates)
+    app.router.add_get('/stats', api.handle_stats)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f"Bot API слушает http://{args.host}:{args.port}")
+    try:
+        async with aiohttp.ClientSession() as api.http:
+            await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        api.print_stats()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,195 @@
+import json
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+from config import STATE_FLUSH_DELAY
+from storage import get_db_connection, run_db
+
+SQL_FSM_SELECT_ALL = 'SELECT key, state, data FROM fsm_state'
+SQL_FSM_UPSERT = (
+    'INSERT INTO fsm_state (key, state, data) VALUES (?, ?, ?) '
+    'ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data'
+)
+SQL_FSM_DELETE = 'DELETE FROM fsm_state WHERE key = ?'
+
+def _key_to_str(key: StorageKey) -> str:
+    return ':'.join(str(part) for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id,
+        getattr(key, 'business_connection_id', None), key.destiny
+    ))
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в той же базе SQLite, что и состояние бота.
+
+    Все состояния загружаются в память при старте, поэтому get_state/get_data
+    обходятся без обращения к базе, как в MemoryStorage. Изменения копятся и
+    пишутся одной транзакцией через flush_delay секунд после первого из них,
+    так что несколько update_data подряд дают одну запись.
+    """
+
+    def __init__(self, flush_delay: float = STATE_FLUSH_DELAY):
+        self.flush_delay = flush_delay
+        self._records = {}  # ключ -> [состояние, данные]
+        self._dirty = set()
+        self._flush_task = None
+        self._load()
+
+    def _load(self):
+        conn = get_db_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fsm_state (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT
+            )
+        ''')
+        conn.commit()
+        for key, state, data in conn.execute(SQL_FSM_SELECT_ALL):
+            self._records[key] = [state, json.loads(data)]
+
+    def _record(self, key: StorageKey) -> list:
+        return self._records.setdefault(_key_to_str(key), [None, {}])
+
+    def _mark_dirty(self, key: StorageKey):
+        self._dirty.add(_key_to_str(key))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self._record(key)[0] = state.state if isinstance(state, State) else state
+        self._mark_dirty(key)
+
+    async def get_state(self, key: StorageKey):
+        record = self._records.get(_key_to_str(key))
+        return record[0] if record else None
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        self._record(key)[1] = data.copy()
+        self._mark_dirty(key)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        record = self._records.get(_key_to_str(key))
+        return record[1].copy() if record else {}
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    async def flush(self):
+        """Записать накопленные изменения в базу одной транзакцией"""
+        if not self._dirty:
+            return
+        upserts = []
+        deletes = []
+        for key in self._dirty:
+            record = self._records.get(key)
+            if record is None or (record[0] is None and not record[1]):
+                # Пустые записи (после state.clear()) не храним
+                self._records.pop(key, None)
+                deletes.append((key,))
+                continue
+            try:
+                upserts.append((key, record[0], json.dumps(record[1], ensure_ascii=False)))
+            except (TypeError, ValueError) as e:
+                logging.error(f"Данные FSM {key} не сохранены в базу: {str(e)}")
+        dirty, self._dirty = self._dirty, set()
+        try:
+            await run_db(self._write, upserts, deletes)
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении состояний FSM: {str(e)}")
+            self._dirty |= dirty  # записи перечитаются при следующей попытке
+        # Изменения, сделанные во время записи, _mark_dirty не запланировал —
+        # задача записи ещё не завершилась
+        if self._dirty:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    @staticmethod
+    def _write(upserts: list, deletes: list):
+        conn = get_db_connection()
+        with conn:
+            conn.executemany(SQL_FSM_UPSERT, upserts)
+            conn.executemany(SQL_FSM_DELETE, deletes)
+
+    async def close(self) -> None:
+        await self.flush()
+
+class RenameSession:
+    """Данные переименования темы, которые живут в FSM между шагами.
+
+    Хранятся одной записью под ключом RenameSession.KEY. Внутри обработчика
+    с ней работают через rename_session(state): запись читается один раз в
+    начале и сохраняется один раз в конце.
+    """
+
+    KEY = 'rename'
+    FIELDS = (
+        'chat_id', 'topic_id', 'old_name', 'topic_name',
+        'confirmation_message_id', 'request_name_message_id', 'pc_selection_message_id'
+    )
+
+    def __init__(self, chat_id: int = None, topic_id: int = None, old_name: str = None,
+                 topic_name: str = None, confirmation_message_id: int = None,
+                 request_name_message_id: int = None, pc_selection_message_id: int = None):
+        self.chat_id = chat_id
+        self.topic_id = topic_id
+        self.old_name = old_name
+        self.topic_name = topic_name
+        self.confirmation_message_id = confirmation_message_id
+        self.request_name_message_id = request_name_message_id
+        self.pc_selection_message_id = pc_selection_message_id
+        self.next_state = None
+        self.finished = False
+
+    @classmethod
+    def from_data(cls, data: dict) -> 'RenameSession':
+        return cls(**{field: value for field, value in (data or {}).items() if field in cls.FIELDS})
+
+    def to_data(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+
+    @property
+    def has_topic(self) -> bool:
+        return self.chat_id is not None and self.topic_id is not None and self.old_name is not None
+
+    @property
+    def number(self):
+        """Номер темы из названия вида 'N:...' или None, если формат другой"""
+        if not self.old_name or ":" not in self.old_name:
+            return None
+        return self.old_name.split(":")[0]
+
+    def set_state(self, state: State):
+        """Перейти в состояние state при сохранении сессии"""
+        self.next_state = state
+
+    def finish(self):
+        """Завершить переименование: при сохранении FSM будет очищен"""
+        self.finished = True
+
+@asynccontextmanager
+async def rename_session(state: FSMContext):
+    """Загрузить RenameSession из FSM и сохранить её по выходе из блока.
+
+    Одно чтение get_data на входе; на выходе set_data, только если сессия
+    изменилась, и set_state, если он был запрошен, либо один clear().
+    """
+    data = await state.get_data()
+    session = RenameSession.from_data(data.get(RenameSession.KEY))
+    loaded = session.to_data()
+    try:
+        yield session
+    finally:
+        if session.finished:
+            await state.clear()
+        else:
+            saved = session.to_data()
+            if saved != loaded:
+                data[RenameSession.KEY] = saved
+                await state.set_data(data)
+            if session.next_state is not None:
+                await state.set_state(session.next_state)
@@ -1,31 +1,47 @@
 
 import asyncio
 import logging
-import sqlite3
 import time
 from datetime import datetime
 
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import Message, CallbackQuery, ChatMemberUpdated, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.exceptions import TelegramRetryAfter
 
 from config import (
-    ADMIN_ID, topics_dict, workers_dict, rename_topics_dict, sos_words,
-    active_topics, active_topics_info, sos_activation_times, sos_removal_tasks,
-    sos_update_tasks, restricted_topics, admin_list, breaks_dict, break_id_counter,
-    break_tasks, pc_mode_enabled, pending_complaints, support_tickets, ticket_id_counter, KYIV_TZ
+    ADMIN_ID, topics_dict, workers_dict, rename_topics_dict, chat_sos_words,
+    active_topics, active_topics_info, sos_activation_times, SOS_AUTO_REMOVE_DELAY,
+    restricted_topics, admin_list, breaks_dict,
+    break_tasks, pc_mode_enabled, pending_complaints, support_tickets, KYIV_TZ,
+    bot_stats
 )
 from utils import (
-    check_forum_support, is_admin, clear_rename_context, create_active_topics_thread,
-    update_active_topics_message, auto_remove_sos, update_sos_times, get_available_pcs,
-    take_pc, release_pc, add_pcs, clear_all_pcs, schedule_break_tasks
+    get_chat_info, invalidate_chat_info, build_topic_link, check_forum_support, is_admin,
+    invalidate_chat_admins, remember_user, resolve_username, run_in_background, notify_workers,
+    get_sos_words, get_sos_matcher, add_sos_word, remove_sos_word,
+    create_active_topics_thread,
+    request_dashboard_update, sos_expiry, ensure_dashboard_ticker, pc_pool, forget_topic,
+    schedule_break_tasks
+)
+import outbox
+from storage import mark_dirty, next_id
+from fsm_storage import RenameSession, rename_session
+from topic_jobs import (
+    topic_jobs, start_topic_job, pause_topic_job, resume_topic_job, cancel_topic_job, delete_topics
 )
 
 router = Router()
 
+@router.message.outer_middleware()
+async def remember_message_users(handler, event: Message, data: dict):
+    """Запоминает username → user_id для каждого входящего сообщения"""
+    remember_user(event.from_user)
+    if event.reply_to_message:
+        remember_user(event.reply_to_message.from_user)
+    return await handler(event, data)
+
 class TopicStates(StatesGroup):
     waiting_for_topic_name = State()
     waiting_for_topic_id = State()
@@ -174,35 +190,30 @@ async def handle_rename_confirmation(callback: CallbackQuery, state: FSMContext)
         await callback.answer("❌ Эта тема больше не доступна для переименования", show_alert=True)
         return
 
-    # Сохраняем данные темы
-    await state.update_data(
-        current_rename_topic={
-            'chat_id': chat_id,
-            'topic_id': topic_id,
-            'old_name': topics_dict[chat_id][topic_id]
-        },
-        waiting_for_rename=True,
-        confirmation_message_id=callback.message.message_id
-    )
-
-    # Отправляем сообщение с запросом имени
-    message = await callback.message.answer(
-        "⚠️ Введите имя ответом на сообщение — это необходимо для присвоения названия теме.\n"
-        "> ⛔️ Без этого тема останется в статусе «Без названия» и будет неактивной.",
-        parse_mode='Markdown'
-    )
-
-    await state.update_data(request_name_message_id=message.message_id)
+    async with rename_session(state) as session:
+        # Сохраняем данные темы
+        session.chat_id = chat_id
+        session.topic_id = topic_id
+        session.old_name = topics_dict[chat_id][topic_id]
+        session.confirmation_message_id = callback.message.message_id
+
+        # Отправляем сообщение с запросом имени
+        message = await callback.message.answer(
+            "⚠️ Введите имя ответом на сообщение — это необходимо для присвоения названия теме.\n"
+            "> ⛔️ Без этого тема останется в статусе «Без названия» и будет неактивной.",
+            parse_mode='Markdown'
+        )
+        session.request_name_message_id = message.message_id
 
-    # Отправляем дополнительное сообщение в тему
-    await callback.bot.send_message(
-        chat_id=chat_id,
-        message_thread_id=topic_id,
-        text="♻️ До присвоения имени тема закрыта для сообщений (кроме администраторов).\n"
-             "🚫 Запрещается занимать более двух тем, вне зависимости от чатов."
-    )
+        # Отправляем дополнительное сообщение в тему
+        await callback.bot.send_message(
+            chat_id=chat_id,
+            message_thread_id=topic_id,
+            text="♻️ До присвоения имени тема закрыта для сообщений (кроме администраторов).\n"
+                 "🚫 Запрещается занимать более двух тем, вне зависимости от чатов."
+        )
 
-    await state.set_state(TopicStates.waiting_for_rename)
+        session.set_state(TopicStates.waiting_for_rename)
     await callback.answer()
 
 @router.callback_query(F.data.startswith('select_pc_'))
@@ -211,43 +222,33 @@ async def handle_pc_selection(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
     pc_id = int(callback.data.split('_')[2])
-    data = await state.get_data()
-    topic_data = data.get('current_rename_topic')
-    topic_name = data.get('topic_name')
+    async with rename_session(state) as session:
+        await select_pc(callback, session, pc_id)
 
-    if not topic_data or not topic_name:
+async def select_pc(callback: CallbackQuery, session: RenameSession, pc_id: int):
+    """Переименовать тему с выбранным ПК по данным сессии переименования"""
+    if not session.has_topic or not session.topic_name:
         await callback.message.edit_text("Ошибка: не найдены данные о теме")
-        await state.clear()
+        session.finish()
         return
 
-    chat_id = topic_data['chat_id']
-    topic_id = topic_data['topic_id']
-    old_name = topic_data['old_name']
+    chat_id = session.chat_id
+    topic_id = session.topic_id
 
     # Проверяем формат старого имени
-    if ":" not in old_name:
+    number = session.number
+    if number is None:
         await callback.message.edit_text("Ошибка: неверный формат названия темы")
-        await state.clear()
+        session.finish()
         return
 
-    number = old_name.split(":")[0]
-
-    # Проверяем, что ПК ещё доступен
-    conn = sqlite3.connect('pc_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT is_available FROM pc_list WHERE id = ?', (pc_id,))
-    result = cursor.fetchone()
-    conn.close()
-
-    if not result or not result[0]:
+    # Занимаем ПК одним атомарным запросом: если его уже кто-то взял, ничего не меняется
+    if not pc_pool.reserve(pc_id):
         await callback.answer("❌ Этот ПК уже занят. Выберите другой.", show_alert=True)
         return
 
-    # Занимаем ПК
-    take_pc(pc_id)
-
     # Формируем новое название темы с номером ПК
-    final_topic_name = f"{number}:{topic_name} (#ПК{pc_id})"
+    final_topic_name = f"{number}:{session.topic_name} (#ПК{pc_id})"
 
     try:
         # Переименовываем тему
@@ -259,16 +260,17 @@ async def handle_pc_selection(callback: CallbackQuery, state: FSMContext):
 
         # Обновляем словарь тем
         topics_dict[chat_id][topic_id] = final_topic_name
+        mark_dirty('topics', chat_id)
         if chat_id in rename_topics_dict:
             rename_topics_dict[chat_id].discard(topic_id)
+            mark_dirty('rename_topics', chat_id)
 
         # Удаляем сообщение с выбором ПК
         try:
-            pc_selection_message_id = data.get('pc_selection_message_id')
-            if pc_selection_message_id:
+            if session.pc_selection_message_id:
                 await callback.bot.delete_message(
                     chat_id=chat_id,
-                    message_id=pc_selection_message_id
+                    message_id=session.pc_selection_message_id
                 )
         except Exception as e:
             logging.error(f"Ошибка при удалении сообщения выбора ПК: {str(e)}")
@@ -281,11 +283,8 @@ async def handle_pc_selection(callback: CallbackQuery, state: FSMContext):
         )
 
         # Отправляем уведомление в топик
-        chat = await callback.bot.get_chat(chat_id)
-        if chat.username:
-            topic_link = f"https://t.me/{chat.username}/{topic_id}"
-        else:
-            topic_link = f"https://t.me/c/{str(chat_id)[4:]}/{topic_id}"
+        chat = await get_chat_info(chat_id, callback.bot)
+        topic_link = build_topic_link(chat, topic_id)
 
         topic_info_message = (
             f"Темы 🆔: {topic_id}\n"
@@ -315,11 +314,11 @@ async def handle_pc_selection(callback: CallbackQuery, state: FSMContext):
 
     except Exception as e:
         # Если что-то пошло не так, освобождаем ПК
-        release_pc(pc_id)
+        pc_pool.release(pc_id)
         await callback.message.edit_text(f"Ошибка при переименовании темы: {str(e)}")
 
     # Очищаем временные данные
-    await state.clear()
+    session.finish()
 
 @router.callback_query(F.data.startswith('occupied_pc_'))
 async def occupied_pc_callback(callback: CallbackQuery):
@@ -327,7 +326,7 @@ async def occupied_pc_callback(callback: CallbackQuery):
     await callback.answer(f"ПК {pc_id} уже занят", show_alert=True)
 
 async def request_topic_name(callback: CallbackQuery, state: FSMContext):
-    chat = await callback.bot.get_chat(callback.message.chat.id)
+    chat = await get_chat_info(callback.message.chat.id, callback.bot)
 
     if chat.type in ['group', 'supergroup']:
         if await check_forum_support(chat.id, callback.bot):
@@ -349,7 +348,7 @@ async def request_topic_name(callback: CallbackQuery, state: FSMContext):
 @router.message(TopicStates.waiting_for_topic_name)
 async def create_topic_with_name(message: Message, state: FSMContext):
     text = message.text
-    chat = await message.bot.get_chat(message.chat.id)
+    chat = await get_chat_info(message.chat.id, message.bot)
 
     if not await check_forum_support(chat.id, message.bot):
         await message.answer(
@@ -395,11 +394,12 @@ async def create_single_topic(chat_id: int, topic_name: str, bot: Bot):
         if chat_id not in topics_dict:
             topics_dict[chat_id] = {}
         topics_dict[chat_id][topic.message_thread_id] = topic_name
+        mark_dirty('topics', chat_id)
     except Exception as e:
         logging.error(f"Ошибка при создании темы {topic_name}: {str(e)}")
 
 async def request_topic_id(callback: CallbackQuery, state: FSMContext):
-    chat = await callback.bot.get_chat(callback.message.chat.id)
+    chat = await get_chat_info(callback.message.chat.id, callback.bot)
 
     if chat.type in ['group', 'supergroup']:
         if await check_forum_support(chat.id, callback.bot):
@@ -432,7 +432,7 @@ async def request_topic_id(callback: CallbackQuery, state: FSMContext):
 @router.message(TopicStates.waiting_for_topic_id)
 async def delete_topic_by_id(message: Message, state: FSMContext):
     topic_id = message.text
-    chat = await message.bot.get_chat(message.chat.id)
+    chat = await get_chat_info(message.chat.id, message.bot)
 
     try:
         topic_id = int(topic_id)
@@ -449,7 +449,7 @@ async def delete_topic_by_id(message: Message, state: FSMContext):
             chat_id=chat.id,
             message_thread_id=topic_id
         )
-        del topics_dict[chat.id][topic_id]
+        forget_topic(chat.id, topic_id, message.bot)
         await message.answer(
             f"Тема '{topic_name}' успешно удалена!"
         )
@@ -466,7 +466,7 @@ async def delete_topic_by_id(message: Message, state: FSMContext):
 
 async def list_topics(callback: CallbackQuery):
     try:
-        chat = await callback.bot.get_chat(callback.message.chat.id)
+        chat = await get_chat_info(callback.message.chat.id, callback.bot)
 
         if chat.type not in ['group', 'supergroup']:
             await callback.message.answer(
@@ -503,7 +503,7 @@ async def list_topics(callback: CallbackQuery):
         )
 
 async def delete_all_topics(callback: CallbackQuery):
-    chat = await callback.bot.get_chat(callback.message.chat.id)
+    chat = await get_chat_info(callback.message.chat.id, callback.bot)
 
     if chat.type not in ['group', 'supergroup']:
         await callback.message.answer("Эта команда доступна только в группах.")
@@ -517,25 +517,21 @@ async def delete_all_topics(callback: CallbackQuery):
         await callback.message.answer("В этой группе нет тем для удаления")
         return
 
-    deleted_count = 0
-    for topic_id in list(topics_dict[chat.id].keys()):
-        try:
-            await callback.bot.delete_forum_topic(
-                chat_id=chat.id,
-                message_thread_id=topic_id
-            )
-            deleted_count += 1
-        except Exception as e:
-            logging.error(f"Ошибка при удалении темы {topic_id}: {str(e)}")
-
-    topics_dict[chat.id] = {}
-    if chat.id in workers_dict:
-        workers_dict[chat.id] = {}
+    topic_ids = list(topics_dict[chat.id])
+    progress = await callback.message.answer(f"🗑 Удаление тем: 0 из {len(topic_ids)}")
+    report = await delete_topics(callback.bot, chat.id, topic_ids, progress.message_id)
 
-    await callback.message.answer(f"Успешно удалено {deleted_count} тем")
+    text = f"Успешно удалено {report['deleted']} тем за {report['elapsed']:.1f} с"
+    if report['failed']:
+        text += f"\nНе удалось удалить: {report['failed']}"
+    try:
+        await outbox.edit_message_text(callback.bot, chat.id, message_id=progress.message_id, text=text)
+    except Exception as e:
+        logging.error(f"Ошибка при обновлении прогресса удаления тем: {str(e)}")
+        await callback.message.answer(text)
 
 async def request_broadcast_message(callback: CallbackQuery, state: FSMContext):
-    chat = await callback.bot.get_chat(callback.message.chat.id)
+    chat = await get_chat_info(callback.message.chat.id, callback.bot)
 
     if chat.type not in ['group', 'supergroup']:
         await callback.message.answer("Эта команда доступна только в группах.")
@@ -555,30 +551,20 @@ async def request_broadcast_message(callback: CallbackQuery, state: FSMContext):
 @router.message(TopicStates.waiting_for_broadcast)
 async def send_broadcast(message: Message, state: FSMContext):
     message_text = message.text
-    chat = await message.bot.get_chat(message.chat.id)
+    chat = await get_chat_info(message.chat.id, message.bot)
 
     if chat.id not in topics_dict or not topics_dict[chat.id]:
         await message.answer("В этой группе нет тем для рассылки")
         await state.clear()
         return
 
-    sent_count = 0
-    for topic_id in topics_dict[chat.id].keys():
-        try:
-            await message.bot.send_message(
-                chat_id=chat.id,
-                message_thread_id=topic_id,
-                text=message_text
-            )
-            sent_count += 1
-        except Exception as e:
-            logging.error(f"Ошибка при отправке сообщения в тему {topic_id}: {str(e)}")
-
-    await message.answer(f"Сообщение отправлено в {sent_count} тем")
+    targets = [(chat.id, topic_id) for topic_id in topics_dict[chat.id]]
     await state.clear()
+    report = await outbox.broadcast(message.bot, targets, message_text)
+    await message.answer(outbox.format_broadcast_report(report))
 
 async def request_rename_topics_count(callback: CallbackQuery, state: FSMContext):
-    chat = await callback.bot.get_chat(callback.message.chat.id)
+    chat = await get_chat_info(callback.message.chat.id, callback.bot)
 
     if chat.type not in ['group', 'supergroup']:
         await callback.message.answer("Эта команда доступна только в группах.")
@@ -593,81 +579,61 @@ async def request_rename_topics_count(callback: CallbackQuery, state: FSMContext
 
 @router.message(TopicStates.waiting_for_rename_count)
 async def create_rename_topics(message: Message, state: FSMContext):
-    global break_id_counter
-
     try:
         count = int(message.text)
-        if count <= 0:
-            await message.answer("Количество тем должно быть положительным числом")
-            await state.clear()
-            return
-
-        chat = await message.bot.get_chat(message.chat.id)
-
-        if chat.id not in rename_topics_dict:
-            rename_topics_dict[chat.id] = set()
-
-        created_count = 0
-        for i in range(1, count + 1):
-            try:
-                topic = await message.bot.create_forum_topic(
-                    chat_id=chat.id,
-                    name=f"{i}:Без названия"
-                )
-
-                if chat.id not in topics_dict:
-                    topics_dict[chat.id] = {}
-                topics_dict[chat.id][topic.message_thread_id] = f"{i}:Без названия"
-
-                rename_topics_dict[chat.id].add(topic.message_thread_id)
-
-                keyboard = [[InlineKeyboardButton(text="✅", callback_data=f'confirm_rename_{topic.message_thread_id}')]]
-                reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-
-                try:
-                    await message.bot.send_message(
-                        chat_id=chat.id,
-                        message_thread_id=topic.message_thread_id,
-                        text="🌏 Чтобы задать название темы, сначала укажите своё имя.\n"
-                             "ℹ️ Не забудьте нажать на галочку под сообщением",
-                        reply_markup=reply_markup
-                    )
-                except TelegramRetryAfter as e:
-                    await asyncio.sleep(e.retry_after)
-                    await message.bot.send_message(
-                        chat_id=chat.id,
-                        message_thread_id=topic.message_thread_id,
-                        text="🌏 Чтобы задать название темы, сначала укажите своё имя.\n"
-                             "ℹ️ Не забудьте нажать на галочку под сообщением",
-                        reply_markup=reply_markup
-                    )
-
-                created_count += 1
-
-                if i < count:  # Не ждем после создания последней темы
-                    await asyncio.sleep(3)  # Задержка между созданием тем
-
-            except TelegramRetryAfter as e:
-                await asyncio.sleep(e.retry_after)
-                continue
-            except Exception as e:
-                logging.error(f"Ошибка при создании темы {i}: {str(e)}")
-
-        try:
-            await message.answer(f"Создано {created_count} тем для переименования.")
-        except TelegramRetryAfter as e:
-            await asyncio.sleep(e.retry_after)
-            await message.answer(f"Создано {created_count} тем для переименования.")
     except ValueError:
         await message.answer("Пожалуйста, введите корректное число")
-    except Exception as e:
-        try:
-            await message.answer(f"Ошибка при создании тем: {str(e)}")
-        except TelegramRetryAfter as e:
-            await asyncio.sleep(e.retry_after)
-            await message.answer(f"Ошибка при создании тем: {str(e)}")
+        await state.clear()
+        return
+
+    if count <= 0:
+        await message.answer("Количество тем должно быть положительным числом")
+        await state.clear()
+        return
 
     await state.clear()
+    chat = await get_chat_info(message.chat.id, message.bot)
+
+    # Темы создаются фоновым заданием: обработчик сразу освобождается,
+    # а прогресс виден в отдельном сообщении с кнопками паузы и отмены
+    job = await start_topic_job(message.bot, chat.id, message.from_user.id, count)
+    if job is None:
+        await message.answer("В этой группе уже идёт создание тем. Дождитесь окончания или отмените его.")
+
+async def can_control_topic_job(callback: CallbackQuery) -> bool:
+    """Управлять заданием может тот, кто его запустил, или админ"""
+    job = topic_jobs.get(callback.message.chat.id)
+    if job is None:
+        await callback.answer("Задание уже завершено")
+        return False
+    if callback.from_user.id != job.user_id and not await is_admin(
+            callback.message.chat.id, callback.from_user.id, callback.bot):
+        await callback.answer("Управлять созданием тем может только тот, кто его запустил, или админ")
+        return False
+    return True
+
+@router.callback_query(F.data == 'topic_job_pause')
+async def pause_rename_topics(callback: CallbackQuery):
+    if not await can_control_topic_job(callback):
+        return
+    await callback.answer("Ставлю на паузу…")
+    await pause_topic_job(callback.message.chat.id, callback.bot)
+
+@router.callback_query(F.data == 'topic_job_resume')
+async def resume_rename_topics(callback: CallbackQuery):
+    if not await can_control_topic_job(callback):
+        return
+    if await resume_topic_job(callback.message.chat.id, callback.bot):
+        await callback.answer("Продолжаю")
+    else:
+        await callback.answer("Задание ещё останавливается, попробуйте через пару секунд")
+
+@router.callback_query(F.data == 'topic_job_cancel')
+async def cancel_rename_topics(callback: CallbackQuery):
+    if not await can_control_topic_job(callback):
+        return
+    await callback.answer("Отменяю…")
+    await cancel_topic_job(callback.message.chat.id, callback.bot)
 
 @router.message(TopicStates.waiting_for_rename)
 async def rename_topic(message: Message, state: FSMContext):
@@ -675,9 +641,13 @@ async def rename_topic(message: Message, state: FSMContext):
     if not message.reply_to_message:
         return
 
-    data = await state.get_data()
+    async with rename_session(state) as session:
+        await set_rename_name(message, session)
+
+async def set_rename_name(message: Message, session: RenameSession):
+    """Принять имя для темы из сессии переименования"""
     # Проверяем, что это ответ на сообщение с запросом имени
-    request_message_id = data.get('request_name_message_id')
+    request_message_id = session.request_name_message_id
     if not request_message_id or message.reply_to_message.message_id != request_message_id:
         return
 
@@ -686,29 +656,27 @@ async def rename_topic(message: Message, state: FSMContext):
         await message.answer("Название не может быть пустым. Введите название темы:")
         return
 
-    topic_data = data.get('current_rename_topic')
-    if not topic_data:
+    if not session.has_topic:
         await message.answer("Ошибка: данные о теме не найдены")
-        await state.clear()
+        session.finish()
         return
 
     # Сохраняем название темы для следующего этапа
-    await state.update_data(topic_name=new_name)
+    session.topic_name = new_name
 
     # Проверяем, включен ли режим выбора ПК
     if not pc_mode_enabled:
         # Режим выбора ПК отключен - сразу переименовываем тему без ПК
-        chat_id = topic_data['chat_id']
-        topic_id = topic_data['topic_id']
-        old_name = topic_data['old_name']
+        chat_id = session.chat_id
+        topic_id = session.topic_id
 
         # Проверяем формат старого имени
-        if ":" not in old_name:
+        number = session.number
+        if number is None:
             await message.answer("Ошибка: неверный формат названия темы")
-            await state.clear()
+            session.finish()
             return
 
-        number = old_name.split(":")[0]
         final_topic_name = f"{number}:{new_name}"
 
         try:
@@ -721,23 +689,22 @@ async def rename_topic(message: Message, state: FSMContext):
 
             # Обновляем словарь тем
             topics_dict[chat_id][topic_id] = final_topic_name
+            mark_dirty('topics', chat_id)
             if chat_id in rename_topics_dict:
                 rename_topics_dict[chat_id].discard(topic_id)
+                mark_dirty('rename_topics', chat_id)
 
             # Удаляем предыдущие сообщения
             try:
-                confirmation_message_id = data.get('confirmation_message_id')
-                request_name_message_id = data.get('request_name_message_id')
-
-                if confirmation_message_id:
+                if session.confirmation_message_id:
                     await message.bot.delete_message(
                         chat_id=chat_id,
-                        message_id=confirmation_message_id
+                        message_id=session.confirmation_message_id
                     )
-                if request_name_message_id:
+                if session.request_name_message_id:
                     await message.bot.delete_message(
                         chat_id=chat_id,
-                        message_id=request_name_message_id
+                        message_id=session.request_name_message_id
                     )
             except Exception as e:
                 logging.error(f"Ошибка при удалении предыдущих сообщений: {str(e)}")
@@ -750,11 +717,8 @@ async def rename_topic(message: Message, state: FSMContext):
             )
 
             # Отправляем информацию о теме
-            chat = await message.bot.get_chat(chat_id)
-            if chat.username:
-                topic_link = f"https://t.me/{chat.username}/{topic_id}"
-            else:
-                topic_link = f"https://t.me/c/{str(chat_id)[4:]}/{topic_id}"
+            chat = await get_chat_info(chat_id, message.bot)
+            topic_link = build_topic_link(chat, topic_id)
 
             topic_info_message = (
                 f"Темы 🆔: {topic_id}\n"
@@ -785,27 +749,21 @@ async def rename_topic(message: Message, state: FSMContext):
             await message.answer(f"Ошибка при переименовании темы: {str(e)}")
 
         # Очищаем временные данные
-        await state.clear()
+        session.finish()
         return
 
     # Переходим к выбору ПК (старая логика)
-    available_pcs = get_available_pcs()
-
-    if not available_pcs:
+    if pc_pool.first_free() is None:
         await message.answer("❌ Нет доступных ПК. Обратитесь к администратору.")
-        await state.clear()
+        session.finish()
         return
 
-    # Получаем все ПК из базы данных
-    conn = sqlite3.connect('pc_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, is_available FROM pc_list ORDER BY id')
-    all_pcs = cursor.fetchall()
-    conn.close()
+    # Получаем все ПК из пула
+    all_pcs = pc_pool.all()
 
     if not all_pcs:
         await message.answer("❌ ПК не настроены. Обратитесь к администратору.")
-        await state.clear()
+        session.finish()
         return
 
     # Создаем клавиатуру со всеми ПК
@@ -830,18 +788,15 @@ async def rename_topic(message: Message, state: FSMContext):
 
     # Удаляем предыдущие сообщения
     try:
-        confirmation_message_id = data.get('confirmation_message_id')
-        request_name_message_id = data.get('request_name_message_id')
-
-        if confirmation_message_id:
+        if session.confirmation_message_id:
             await message.bot.delete_message(
-                chat_id=topic_data['chat_id'],
-                message_id=confirmation_message_id
+                chat_id=session.chat_id,
+                message_id=session.confirmation_message_id
             )
-        if request_name_message_id:
+        if session.request_name_message_id:
             await message.bot.delete_message(
-                chat_id=topic_data['chat_id'],
-                message_id=request_name_message_id
+                chat_id=session.chat_id,
+                message_id=session.request_name_message_id
             )
     except Exception as e:
         logging.error(f"Ошибка при удалении предыдущих сообщений: {str(e)}")
@@ -853,8 +808,8 @@ async def rename_topic(message: Message, state: FSMContext):
     )
 
     # Сохраняем ID сообщения для последующего удаления
-    await state.update_data(pc_selection_message_id=pc_selection_message.message_id)
-    await state.set_state(TopicStates.waiting_for_pc_selection)
+    session.pc_selection_message_id = pc_selection_message.message_id
+    session.set_state(TopicStates.waiting_for_pc_selection)
 
 # Break management functions
 async def show_break_menu(callback: CallbackQuery):
@@ -1011,8 +966,6 @@ async def process_break_end_time(message: Message, state: FSMContext):
 @router.message(TopicStates.waiting_for_break_end_text)
 async def process_break_end_text(message: Message, state: FSMContext):
     """Обработать текст окончания перерыва и создать перерыв"""
-    global break_id_counter
-
     end_text = message.text.strip()
 
     if len(end_text) > 200:
@@ -1027,9 +980,9 @@ async def process_break_end_text(message: Message, state: FSMContext):
     break_data = data['break_data']
     break_data['end_text'] = end_text
 
-    break_id = break_id_counter
+    break_id = next_id('break')
     breaks_dict[break_id] = break_data
-    break_id_counter += 1
+    mark_dirty('breaks', break_id)
 
     # Планируем задачи для перерыва
     await schedule_break_tasks(break_id, break_data, message.bot)
@@ -1094,6 +1047,7 @@ async def delete_break(callback: CallbackQuery, break_id: int):
 
     # Удаляем перерыв
     del breaks_dict[break_id]
+    mark_dirty('breaks', break_id)
 
     await callback.answer(f"Перерыв '{break_name}' удален!", show_alert=True)
 
@@ -1152,7 +1106,7 @@ async def worker_command(message: Message):
         await message.answer("Необходимо указать хотя бы одного пользователя")
         return
 
-    chat = await message.bot.get_chat(chat_id)
+    chat = await get_chat_info(chat_id, message.bot)
 
     if not await check_forum_support(chat.id, message.bot):
         await message.answer("Эта группа не поддерживает темы")
@@ -1174,6 +1128,7 @@ async def worker_command(message: Message):
         if user not in existing_workers:
             workers_dict[chat_id][message_thread_id].append(user)
             new_workers.append(user)
+    mark_dirty('workers', chat_id)
 
     if new_workers:
         new_workers_text = " ".join(new_workers)
@@ -1216,6 +1171,7 @@ async def only_command(message: Message):
             del restricted_topics[chat_id][message_thread_id]
             if not restricted_topics[chat_id]:
                 del restricted_topics[chat_id]
+            mark_dirty('restricted_topics', chat_id)
 
             topic_name = topics_dict.get(chat_id, {}).get(message_thread_id, f"Тема {message_thread_id}")
             await message.answer(
@@ -1237,6 +1193,7 @@ async def only_command(message: Message):
 
     # Устанавливаем ограничения для темы
     restricted_topics[chat_id][message_thread_id] = users
+    mark_dirty('restricted_topics', chat_id)
 
     users_text = " ".join(users)
     topic_name = topics_dict.get(chat_id, {}).get(message_thread_id, f"Тема {message_thread_id}")
@@ -1291,11 +1248,13 @@ async def new_command(message: Message):
 
         # Обновляем словарь тем
         topics_dict[chat_id][message_thread_id] = new_name
+        mark_dirty('topics', chat_id)
 
         # Добавляем тему в список тем для переименования
         if chat_id not in rename_topics_dict:
             rename_topics_dict[chat_id] = set()
         rename_topics_dict[chat_id].add(message_thread_id)
+        mark_dirty('rename_topics', chat_id)
 
         # Создаем новое сообщение с галочкой для переименования
         keyboard = [[InlineKeyboardButton(text="✅", callback_data=f'confirm_rename_{message_thread_id}')]]
@@ -1332,7 +1291,7 @@ async def pc_command(message: Message):
     if not args:
         # Показываем текущее состояние ПК
         mode_status = "включен" if pc_mode_enabled else "отключен"
-        available_pcs = get_available_pcs()
+        available_pcs = pc_pool.available()
         if available_pcs and pc_mode_enabled:
             pcs_text = ", ".join(map(str, available_pcs))
             await message.answer(
@@ -1357,7 +1316,7 @@ async def pc_command(message: Message):
     arg = args[0].lower()
 
     if arg == "clear":
-        clear_all_pcs()
+        pc_pool.clear()
         await message.answer("✅ Весь список ПК очищен")
     elif arg == "0":
         pc_mode_enabled = False
@@ -1374,15 +1333,19 @@ async def pc_command(message: Message):
                 return
 
             pc_mode_enabled = True
-            add_pcs(count)
-            available_pcs = get_available_pcs()
+            pc_pool.add(count)
+            available_pcs = pc_pool.available()
             pcs_text = ", ".join(map(str, available_pcs))
             await message.answer(f"✅ Режим выбора ПК включен\nДобавлено ПК до номера {count}\nДоступные ПК: {pcs_text}")
         except ValueError:
             await message.answer("❌ Неверный формат. Используйте: /pc <число>, /pc 0 или /pc clear")
 
+def sos_words_scope(message: Message):
+    """Чей список SOS-слов меняет команда: в личке — общий, в группе — список группы"""
+    return None if message.chat.type == 'private' else message.chat.id
+
 @router.message(Command("gadd"))
-async def add_sos_word(message: Message):
+async def add_sos_word_command(message: Message):
     if not await is_admin(message.chat.id, message.from_user.id, message.bot):
         await message.answer("Эта команда доступна только администраторам")
         return
@@ -1395,15 +1358,14 @@ async def add_sos_word(message: Message):
         return
 
     word = args[0].lower()
-    if word in sos_words:
+    if not add_sos_word(sos_words_scope(message), word):
         await message.answer(f"Слово '{word}' уже есть в списке")
         return
 
-    sos_words.add(word)
     await message.answer(f"Слово '{word}' добавлено в список SOS-слов")
 
 @router.message(Command("gdel"))
-async def delete_sos_word(message: Message):
+async def delete_sos_word_command(message: Message):
     if not await is_admin(message.chat.id, message.from_user.id, message.bot):
         await message.answer("Эта команда доступна только администраторам")
         return
@@ -1416,11 +1378,10 @@ async def delete_sos_word(message: Message):
         return
 
     word = args[0].lower()
-    if word not in sos_words:
+    if not remove_sos_word(sos_words_scope(message), word):
         await message.answer(f"Слово '{word}' не найдено в списке")
         return
 
-    sos_words.remove(word)
     await message.answer(f"Слово '{word}' удалено из списка SOS-слов")
 
 @router.message(Command("gall"))
@@ -1429,12 +1390,14 @@ async def list_sos_words(message: Message):
         await message.answer("Эта команда доступна только администраторам")
         return
 
-    if not sos_words:
+    words = get_sos_words(message.chat.id)
+    if not words:
         await message.answer("Список SOS-слов пуст")
         return
 
-    words_list = "\n".join(sorted(sos_words))
-    await message.answer(f"Список SOS-слов:\n{words_list}")
+    scope = "этого чата" if message.chat.id in chat_sos_words else "общий"
+    words_list = "\n".join(sorted(words))
+    await message.answer(f"Список SOS-слов ({scope}):\n{words_list}")
 
 @router.message(Command("admin"))
 async def admin_command(message: Message):
@@ -1498,24 +1461,8 @@ async def admin_command(message: Message):
         if user_input.startswith('@'):
             username = user_input[1:]  # Убираем @
             try:
-                # Пытаемся найти пользователя по username в текущем чате
-                chat_id = message.chat.id
-
-                # Получаем администраторов чата
-                chat_admins = await message.bot.get_chat_administrators(chat_id)
-                for admin in chat_admins:
-                    if admin.user.username and admin.user.username.lower() == username.lower():
-                        new_admin_id = admin.user.id
-                        break
-
-                # Если не нашли среди админов, пробуем среди участников
-                if not new_admin_id:
-                    try:
-                        chat_member = await message.bot.get_chat_member(chat_id, f"@{username}")
-                        if chat_member and chat_member.user:
-                            new_admin_id = chat_member.user.id
-                    except Exception:
-                        pass
+                # Ищем пользователя среди известных боту участников и администраторов чата
+                new_admin_id = await resolve_username(message.chat.id, username, message.bot)
 
                 if not new_admin_id:
                     await message.answer(f"❌ Пользователь @{username} не найден в этом чате")
@@ -1541,6 +1488,7 @@ async def admin_command(message: Message):
             return
 
         admin_list.add(new_admin_id)
+        mark_dirty('admin_list')
 
         # Получаем информацию о пользователе для подтверждения
         try:
@@ -1566,6 +1514,7 @@ async def admin_command(message: Message):
                 return
 
             admin_list.remove(admin_to_remove)
+            mark_dirty('admin_list')
             await message.answer(f"✅ Пользователь {admin_to_remove} удален из администраторов")
 
         except ValueError:
@@ -1580,6 +1529,89 @@ async def admin_command(message: Message):
             "/admin list - показать список"
         )
 
+@router.message(Command("stats"))
+async def stats_command(message: Message):
+    """Статистика кэшей и обращений к API"""
+    if not await is_admin(message.chat.id, message.from_user.id, message.bot):
+        await message.answer("Эта команда доступна только администраторам")
+        return
+
+    chat_hits = bot_stats['chat_cache_hits']
+    chat_misses = bot_stats['chat_cache_misses']
+    admin_hits = bot_stats['admin_cache_hits']
+    admin_misses = bot_stats['admin_cache_misses']
+    admin_total = admin_hits + admin_misses
+    admin_hit_rate = admin_hits / admin_total * 100 if admin_total else 0
+    username_hits = bot_stats['username_hits'] + bot_stats['username_negative_hits']
+    notify_jobs = bot_stats['sos_notify_jobs']
+    dashboard_saved = bot_stats['dashboard_coalesced'] + bot_stats['dashboard_unchanged']
+    ticker_ticks = bot_stats['ticker_ticks']
+    ticker_avg_chats = bot_stats['ticker_chats_total'] / ticker_ticks if ticker_ticks else 0
+    outbox_sent = bot_stats['outbox_sent']
+    outbox_avg_wait = bot_stats['outbox_wait_ms_total'] // outbox_sent if outbox_sent else 0
+    notify_avg_ms = bot_stats['sos_notify_total_ms'] // notify_jobs if notify_jobs else 0
+
+    await message.answer(
+        "📊 Статистика\n\n"
+        f"Кэш чатов: {chat_hits} из кэша, {chat_misses} запросов get_chat\n"
+        f"Кэш админов: {admin_hits} из кэша, {admin_misses} запросов "
+        f"get_chat_administrators ({admin_hit_rate:.1f}% попаданий)\n"
+        f"Поиск по username: {bot_stats['username_hits']} найдено, "
+        f"{bot_stats['username_misses']} не найдено, {bot_stats['username_negative_hits']} пропущено до повтора\n"
+        f"Уведомления SOS: {notify_jobs} рассылок, от SOS до последнего ЛС "
+        f"{bot_stats['sos_notify_last_ms']} мс (в среднем {notify_avg_ms} мс)\n"
+        f"Дашборд: {bot_stats['dashboard_edits']} правок, {dashboard_saved} сэкономлено "
+        f"({bot_stats['dashboard_coalesced']} объединено, {bot_stats['dashboard_unchanged']} без изменений)\n"
+        f"Обновление времени простоя: {bot_stats['ticker_last_chats']} чатов за последний цикл "
+        f"(в среднем {ticker_avg_chats:.1f})\n"
+        f"Очередь запросов: {outbox.queue_depth()} ждут, {outbox_sent} отправлено, "
+        f"ожидание в среднем {outbox_avg_wait} мс (макс. {bot_stats['outbox_wait_ms_max']} мс), "
+        f"RetryAfter: {bot_stats['outbox_retry_after']}\n"
+        f"Рассылки: {bot_stats['broadcasts']}, доставлено {bot_stats['broadcast_messages']} сообщений\n"
+        f"Сэкономлено запросов к API: {chat_hits + admin_hits + username_hits + dashboard_saved}"
+    )
+
+@router.message(Command("rates"))
+async def rates_command(message: Message):
+    """Частоты запросов, подобранные по ответам Telegram"""
+    if not await is_admin(message.chat.id, message.from_user.id, message.bot):
+        await message.answer("Эта команда доступна только администраторам")
+        return
+
+    rates = outbox.learned_rates()
+    if not rates:
+        await message.answer("Запросов через очередь ещё не было")
+        return
+
+    family_names = {'message': 'сообщения', 'edit': 'правки', 'topic': 'темы'}
+    lines = []
+    for chat_id, family, bucket in rates[:30]:
+        line = (
+            f"{chat_id} · {family_names.get(family, family)}: {bucket.rate * 60:.1f}/мин "
+            f"(от {bucket.min_rate * 60:.0f} до {bucket.max_rate * 60:.0f}), "
+            f"успешно {bucket.successes}"
+        )
+        if bucket.retry_afters:
+            line += f", RetryAfter {bucket.retry_afters} (последний {bucket.last_retry_after} с)"
+        lines.append(line)
+
+    await message.answer("📈 Подобранные частоты запросов\n\n" + "\n".join(lines))
+
+@router.my_chat_member()
+async def on_my_chat_member(update: ChatMemberUpdated):
+    """Сбрасывает кэши чата при изменении прав бота в нём"""
+    invalidate_chat_info(update.chat.id)
+    invalidate_chat_admins(update.chat.id)
+
+@router.chat_member()
+async def on_chat_member(update: ChatMemberUpdated):
+    """Сбрасывает кэш администраторов, когда кто-то получает или теряет права"""
+    admin_statuses = ('creator', 'administrator')
+    remember_user(update.new_chat_member.user)
+    if (update.old_chat_member.status in admin_statuses or
+            update.new_chat_member.status in admin_statuses):
+        invalidate_chat_admins(update.chat.id)
+
 # Menu functions
 async def start_complaint(callback: CallbackQuery, state: FSMContext):
     """Начать процесс подачи жалобы"""
@@ -1689,8 +1721,6 @@ async def start_support(callback: CallbackQuery, state: FSMContext):
 @router.message(TopicStates.waiting_for_support_message)
 async def process_support_message(message: Message, state: FSMContext):
     """Обработать сообщение в поддержку"""
-    global ticket_id_counter
-    
     data = await state.get_data()
     user_replying_ticket_id = data.get('user_replying_ticket_id')
     
@@ -1755,8 +1785,7 @@ async def process_support_message(message: Message, state: FSMContext):
     
     else:
         # Это новый тикет
-        ticket_id = ticket_id_counter
-        ticket_id_counter += 1
+        ticket_id = next_id('ticket')
         
         support_tickets[ticket_id] = {
             'user_id': message.from_user.id,
@@ -1765,6 +1794,7 @@ async def process_support_message(message: Message, state: FSMContext):
             'chat_id': message.chat.id,
             'status': 'open'
         }
+        mark_dirty('support_tickets', ticket_id)
         
         # Отправляем подтверждение пользователю
         await message.answer(
@@ -1912,6 +1942,7 @@ async def close_ticket(callback: CallbackQuery):
     
     ticket = support_tickets[ticket_id]
     ticket['status'] = 'closed'
+    mark_dirty('support_tickets', ticket_id)
     
     # Уведомляем пользователя о закрытии тикета
     try:
@@ -1933,6 +1964,10 @@ async def close_ticket(callback: CallbackQuery):
 # Message handler for general messages
 @router.message()
 async def handle_message(message: Message):
+    # Служебные сообщения об изменении чата делают кэш устаревшим
+    if message.new_chat_title or message.migrate_to_chat_id:
+        invalidate_chat_info(message.chat.id)
+
     if not message.text:
         return
 
@@ -2027,27 +2062,19 @@ async def check_sos_word(message: Message):
         return
 
     # Проверяем, содержит ли сообщение SOS-слово
-    sos_found = False
-    for word in sos_words:
-        if word in message_text:
-            sos_found = True
-            logging.info(f"Найдено SOS-слово: {word}")
-            break
-
-    if sos_found:
+    word = get_sos_matcher(chat_id).search(message_text)
+    if word:
+        logging.info(f"Найдено SOS-слово: {word}")
+        sos_started_at = time.monotonic()
         try:
-            # Проверяем, не активен ли уже SOS в этой теме
-            if (chat_id in active_topics and 
-                message_thread_id in active_topics[chat_id]):
-                # SOS уже активен, отменяем старые задачи и создаем новые
-                task_key = (chat_id, message_thread_id)
-                if task_key in sos_removal_tasks:
-                    sos_removal_tasks[task_key].cancel()
-                    del sos_removal_tasks[task_key]
-            else:
-                # Создаем топик "Активные темы" если его нет
+            # Создаем топик "Активные темы", пока его нет: после неудачной
+            # попытки он создаётся заново при следующем SOS, даже в уже активной теме
+            if chat_id not in active_topics_info:
                 await create_active_topics_thread(chat_id, message.bot)
 
+            # Проверяем, не активен ли уже SOS в этой теме
+            if (chat_id not in active_topics or
+                message_thread_id not in active_topics[chat_id]):
                 # Добавляем тему в активные
                 if chat_id not in active_topics:
                     active_topics[chat_id] = set()
@@ -2056,104 +2083,21 @@ async def check_sos_word(message: Message):
             # Сохраняем время активации SOS
             sos_activation_times[(chat_id, message_thread_id)] = time.time()
 
-            # Запускаем задачу автоматического снятия SOS через 5 минут
-            task_key = (chat_id, message_thread_id)
-            sos_removal_tasks[task_key] = asyncio.create_task(
-                auto_remove_sos(chat_id, message_thread_id, message.bot)
-            )
+            # Назначаем (или продлеваем) автоматическое снятие SOS через 5 минут
+            sos_expiry.schedule(chat_id, message_thread_id, SOS_AUTO_REMOVE_DELAY, message.bot)
 
-            # Запускаем задачу обновления времени, если её ещё нет для этого чата
-            if chat_id not in sos_update_tasks:
-                sos_update_tasks[chat_id] = asyncio.create_task(
-                    update_sos_times(chat_id, message.bot)
-                )
+            # Запускаем общий цикл обновления времени простоя, если он ещё не запущен
+            ensure_dashboard_ticker(message.bot)
 
             # Обновляем сообщение в топике "Активные темы"
-            await update_active_topics_message(chat_id, message.bot)
+            request_dashboard_update(chat_id, message.bot)
 
-            # Проверяем, есть ли назначенные воркеры для этой темы
+            # Уведомляем назначенных воркеров в фоне, чтобы не задерживать обработку сообщений
             if chat_id in workers_dict and message_thread_id in workers_dict[chat_id]:
-                workers = workers_dict[chat_id][message_thread_id]
-                topic_name = topics_dict.get(chat_id, {}).get(message_thread_id, f"Тема {message_thread_id}")
-
-                # Создаем ссылку на топик
-                try:
-                    chat = await message.bot.get_chat(chat_id)
-                    if chat.username:
-                        link = f"https://t.me/{chat.username}/{message_thread_id}"
-                    else:
-                        # Для приватных чатов используем другой формат
-                        link = f"https://t.me/c/{str(chat_id)[4:]}/{message_thread_id}"
-
-                    # Отправляем уведомления воркерам в личные сообщения
-                    for worker in workers:
-                        # Убираем @ из упоминания пользователя, если есть
-                        username = worker.replace('@', '') if worker.startswith('@') else worker
-
-                        try:
-                            notification_text = (
-                                f"🚨 ВНИМАНИЕ! Нужен номер в теме '{topic_name}'\n"
-                                f"Ссылка: {link}"
-                            )
-
-                            # Пытаемся найти пользователя по username и отправить ЛС
-                            try:
-                                # Получаем информацию о участниках чата для поиска user_id по username
-                                chat_members = await message.bot.get_chat_administrators(chat_id)
-                                user_id = None
-
-                                # Ищем user_id по username среди администраторов
-                                for member in chat_members:
-                                    if member.user.username and member.user.username.lower() == username.lower():
-                                        user_id = member.user.id
-                                        break
-
-                                # Если не нашли среди админов, пробуем среди обычных участников
-                                if not user_id:
-                                    try:
-                                        chat_member = await message.bot.get_chat_member(chat_id, f"@{username}")
-                                        if chat_member:
-                                            user_id = chat_member.user.id
-                                    except:
-                                        pass
-
-                                if user_id:
-                                    # Пытаемся отправить ЛС
-                                    await message.bot.send_message(
-                                        chat_id=user_id,
-                                        text=notification_text,
-                                        disable_web_page_preview=True
-                                    )
-                                    logging.info(f"Отправлено ЛС воркеру {worker} (ID: {user_id})")
-                                else:
-                                    # Если не смогли найти user_id, отправляем в группу
-                                    await message.bot.send_message(
-                                        chat_id=chat_id,
-                                        message_thread_id=message_thread_id,
-                                        text=f"🚨 ВНИМАНИЕ! {worker} - нужен номер!",
-                                        disable_web_page_preview=True
-                                    )
-                                    logging.info(f"Не удалось найти user_id для {worker}, отправлено в группу")
-
-                            except Exception as dm_error:
-                                # Если не удалось отправить ЛС (пользователь не начинал диалог с ботом)
-                                logging.warning(f"Не удалось отправить ЛС воркеру {worker}: {str(dm_error)}")
-                                # Отправляем в группу как fallback
-                                await message.bot.send_message(
-                                    chat_id=chat_id,
-                                    message_thread_id=message_thread_id,
-                                    text=f"🚨 ВНИМАНИЕ! {worker} - нужен номер!",
-                                    disable_web_page_preview=True
-                                )
-                                logging.info(f"Отправлено в группу как fallback для {worker}")
-
-                        except Exception as e:
-                            logging.error(f"Общая ошибка при отправке уведомления воркеру {worker}: {str(e)}")
-
-                    logging.info(f"Отправлены уведомления воркерам для темы {message_thread_id}")
-
-                except Exception as e:
-                    logging.error(f"Ошибка при отправке уведомлений воркерам: {str(e)}")
+                workers = list(workers_dict[chat_id][message_thread_id])
+                run_in_background(
+                    notify_workers(chat_id, message_thread_id, workers, message.bot, sos_started_at)
+                )
 
         except Exception as e:
             logging.error(f"Общая ошибка в check_sos_word: {str(e)}")
@@ -0,0 +1,116 @@
+"""Нагрузочный тест webhook-сервера бота.
+
+Отправляет POST-запросы с обновлениями Telegram на запущенный webhook
+(main.py с WEBHOOK_URL) с заданной частотой и печатает пропускную
+способность и задержки ответа.
+
+Запуск:
+    python load_webhook.py --url http://127.0.0.1:8080/webhook --rate 3000 --count 30000
+    python load_webhook.py --updates recorded.jsonl   # записанные обновления, по одному JSON в строке
+
+Обычно main.py регистрирует webhook с handle_in_background=True: сервер
+отвечает сразу, а обновление обрабатывает в фоне, и задержка здесь — только
+время приёма обновления. Чтобы измерить пропускную способность и p99
+самих обработчиков, бот запускают в режиме нагрузочного теста с
+WEBHOOK_SYNC=1 (ответ приходит после обработки) и с BOT_API_URL на
+fake_bot_api.py, чтобы не ходить в настоящий Telegram:
+    python fake_bot_api.py --port 8081 &
+    WEBHOOK_SYNC=1 BOT_API_URL=http://127.0.0.1:8081 WEBHOOK_URL=http://127.0.0.1:8080 python main.py &
+    python load_webhook.py --rate 500 --count 5000
+В продакшене WEBHOOK_SYNC не задают. Задержки отдельных обработчиков без
+HTTP измеряет bench_router.py.
+"""
+import json
+import time
+import asyncio
+import argparse
+
+import aiohttp
+
+from config import WEBHOOK_SECRET
+
+def synthetic_updates(count: int, chat_id: int = -1001234567890):
+    """Обычная переписка в темах форума, примерно каждое двадцатое сообщение с SOS-словом"""
+    for update_id in range(1, count + 1):
+        topic_id = 2 + update_id % 50
+        user_id = 1000 + update_id % 200
+        text = "нужен номер" if update_id % 20 == 0 else f"сообщение {update_id}"
+        yield {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'message_thread_id': topic_id,
+                'is_topic_message': True,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'Load test', 'is_forum': True},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}", 'username': f"user{user_id}"},
+                'text': text
+            }
+        }
+
+def recorded_updates(path: str, count: int):
+    with open(path, encoding='utf-8') as f:
+        lines = [line for line in f if line.strip()]
+    for i in range(count):
+        update = json.loads(lines[i % len(lines)])
+        update['update_id'] = i + 1
+        yield update
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8080/webhook')
+    parser.add_argument('--rate', type=float, default=3000, help='запросов в секунду')
+    parser.add_argument('--count', type=int, default=30000)
+    parser.add_argument('--concurrency', type=int, default=256)
+    parser.add_argument('--updates', help='файл с записанными обновлениями (JSON в строке)')
+    args = parser.parse_args()
+
+    if args.updates:
+        updates = recorded_updates(args.updates, args.count)
+    else:
+        updates = synthetic_updates(args.count)
+
+    headers = {'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    latencies = []
+    statuses = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def post(update: dict):
+            try:
+                started = time.perf_counter()
+                async with session.post(args.url, json=update) as response:
+                    await response.read()
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+                latencies.append(time.perf_counter() - started)
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] = statuses.get(type(e).__name__, 0) + 1
+            finally:
+                semaphore.release()
+
+        tasks = []
+        started = time.perf_counter()
+        for i, update in enumerate(updates):
+            # Держим заданную частоту: i-й запрос уходит не раньше i / rate
+            delay = started + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(post(update)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    print(f"Отправлено {args.count} обновлений за {elapsed:.2f} с: {args.count / elapsed:.0f} в секунду")
+    print(f"Ответы: {statuses}")
+    print(
+        f"Задержка ответа: p50 {percentile(latencies, 0.5) * 1000:.1f} мс, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.1f} мс, "
+        f"макс. {max(latencies, default=0) * 1000:.1f} мс"
+    )
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,33 +1,100 @@
 import asyncio
 import logging
+import signal
+from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
-from config import TOKEN, sos_removal_tasks, sos_update_tasks, break_tasks, support_tickets
+from config import (
+    TOKEN, BOT_API_URL, break_tasks, breaks_dict,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SYNC
+)
 from handlers import router
+from storage import state_store, close_database
+from fsm_storage import SQLiteStorage
+from utils import pc_pool, sos_expiry, stop_dashboard_ticker, schedule_break_tasks
+from topic_jobs import resume_topic_jobs
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Принимать обновления через aiohttp-сервер вместо long polling"""
+    async def on_startup(bot: Bot):
+        await bot.set_webhook(
+            f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logging.info(f"Webhook установлен: {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+    dp.startup.register(on_startup)
+
+    app = web.Application()
+    # Запросы без верного X-Telegram-Bot-Api-Secret-Token отклоняются.
+    # Обновление обрабатывается в фоне, а Telegram сразу получает ответ: рассылка
+    # или удаление всех тем длятся дольше таймаута webhook, и Telegram прислал бы
+    # то же обновление повторно (рассылка ушла бы дважды).
+    # WEBHOOK_SYNC=1 — режим нагрузочного теста: ответ после обработчиков
+    if WEBHOOK_SYNC:
+        logging.warning("WEBHOOK_SYNC=1: обновления обрабатываются до ответа, только для нагрузочных тестов")
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, handle_in_background=not WEBHOOK_SYNC, secret_token=WEBHOOK_SECRET
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    logging.info(f"Webhook-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    # Как и polling в aiogram, останавливаемся по SIGTERM/SIGINT штатно, чтобы
+    # main() успел записать ПК, состояние и FSM в базу (например, при docker stop)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: остаётся KeyboardInterrupt
+    try:
+        await stop.wait()
+        logging.info("Webhook-сервер останавливается")
+    finally:
+        await runner.cleanup()
 
 async def main():
     # Initialize bot and dispatcher
-    bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    storage = MemoryStorage()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None
+    bot = Bot(token=TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # Состояния FSM (переименование, мастер перерыва, ответы в поддержку)
+    # хранятся в базе и переживают перезапуск
+    storage = SQLiteStorage()
     dp = Dispatcher(storage=storage)
 
     # Include handlers
     dp.include_router(router)
 
+    # Продолжаем создание тем, прерванное перезапуском
+    resume_topic_jobs(bot)
+
+    # Перерывы загружены из базы — заново планируем их уведомления
+    for break_id, break_data in breaks_dict.items():
+        await schedule_break_tasks(break_id, break_data, bot)
+
     try:
-        # Start polling
-        await dp.start_polling(bot)
+        if WEBHOOK_URL:
+            await run_webhook(bot, dp)
+        else:
+            # Start polling (chat_member приходит только если явно запрошен)
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     except KeyboardInterrupt:
         # Отменяем все активные задачи при завершении
-        for task in sos_removal_tasks.values():
-            if not task.done():
-                task.cancel()
-        for task in sos_update_tasks.values():
-            if not task.done():
-                task.cancel()
+        sos_expiry.stop()
+        stop_dashboard_ticker()
         # Отменяем задачи перерывов
         for break_tasks_list in break_tasks.values():
             for task in break_tasks_list:
@@ -36,6 +103,10 @@ async def main():
         logging.info("Бот остановлен")
     finally:
         await bot.session.close()
+        await pc_pool.flush()
+        await state_store.flush()
+        await storage.close()
+        close_database()
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,265 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import (
+    OUTBOX_GLOBAL_RATE, OUTBOX_GROUP_LIMITS, OUTBOX_PRIVATE_LIMITS, AIMD_INCREASE, AIMD_DECREASE,
+    OUTBOX_MAX_RETRIES, BULK_MAX_RETRIES, bot_stats
+)
+
+# Классы приоритета: чем меньше число, тем раньше уходит запрос
+PRIORITY_ALERT = 0      # уведомления воркерам о SOS
+PRIORITY_DASHBOARD = 1  # правки 'Активных тем'
+PRIORITY_DEFAULT = 2
+PRIORITY_BROADCAST = 3  # рассылки и уведомления о перерывах
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Запретить запросы на seconds секунд (после RetryAfter)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0)
+
+class AdaptiveBucket(TokenBucket):
+    """Ограничитель, который подбирает частоту по ответам Telegram (AIMD).
+
+    После каждого удачного запроса частота растёт на AIMD_INCREASE, после
+    RetryAfter — умножается на AIMD_DECREASE. Так массовые операции идут
+    настолько быстро, насколько позволяет Telegram, и редко упираются в лимит.
+    """
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float, capacity: float):
+        super().__init__(rate, capacity)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.successes = 0
+        self.retry_afters = 0
+        self.last_retry_after = 0.0
+
+    def on_success(self):
+        self.successes += 1
+        self.rate = min(self.max_rate, self.rate + AIMD_INCREASE)
+
+    def on_retry_after(self, retry_after: float):
+        self.retry_afters += 1
+        self.last_retry_after = retry_after
+        # Запросы, отправленные до блокировки, получат RetryAfter пачкой —
+        # частоту снижаем один раз на блокировку, а не за каждый из них
+        if self.blocked_until <= time.monotonic():
+            self.rate = max(self.min_rate, self.rate * AIMD_DECREASE)
+        self.block(retry_after)
+
+class PriorityGate:
+    """Выдаёт токены ограничителя ожидающим в порядке приоритета"""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self._waiters = []
+        self._seq = itertools.count()
+        self._task = None
+
+    def __len__(self):
+        return len(self._waiters)
+
+    async def acquire(self, priority: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        while self._waiters:
+            delay = self.bucket.delay(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            # Пока ждали, мог прийти запрос с более высоким приоритетом — берём верхний
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # ожидающий был отменён
+            self.bucket.consume(time.monotonic())
+            future.set_result(None)
+
+class Outbox:
+    """Очередь исходящих запросов к Bot API.
+
+    Каждый запрос проходит лимит своего чата и семейства методов (сообщения,
+    правки, темы) и общий лимит бота (около 30 в секунду). В обоих местах
+    очередь упорядочена по приоритету. Лимит чата подстраивается под ответы
+    Telegram (AdaptiveBucket). При TelegramRetryAfter чат блокируется на
+    указанное время, и запрос повторяется.
+    """
+
+    def __init__(self):
+        self._global = PriorityGate(TokenBucket(OUTBOX_GLOBAL_RATE, OUTBOX_GLOBAL_RATE))
+        self._chats = {}  # (chat_id, семейство методов) -> PriorityGate
+
+    def _chat_gate(self, chat_id: int, family: str) -> PriorityGate:
+        gate = self._chats.get((chat_id, family))
+        if gate is None:
+            if chat_id < 0:
+                limits = OUTBOX_GROUP_LIMITS.get(family, OUTBOX_GROUP_LIMITS['message'])
+            else:
+                limits = OUTBOX_PRIVATE_LIMITS
+            gate = PriorityGate(AdaptiveBucket(*limits))
+            self._chats[(chat_id, family)] = gate
+        return gate
+
+    def rate(self, chat_id: int, family: str) -> float:
+        """Текущая частота запросов семейства family в чат, в секунду"""
+        return self._chat_gate(chat_id, family).bucket.rate
+
+    def learned_rates(self) -> list:
+        """Подобранные частоты: [(chat_id, семейство, AdaptiveBucket)], сначала с RetryAfter"""
+        rates = [(chat_id, family, gate.bucket) for (chat_id, family), gate in self._chats.items()]
+        rates.sort(key=lambda item: (-item[2].retry_afters, -item[2].successes))
+        return rates
+
+    def queue_depth(self) -> int:
+        """Сколько запросов сейчас ждут своей очереди"""
+        return len(self._global) + sum(len(gate) for gate in self._chats.values())
+
+    async def call(self, chat_id: int, make_request, priority: int = PRIORITY_DEFAULT,
+                   max_retries: int = OUTBOX_MAX_RETRIES, family: str = 'message'):
+        """Выполнить запрос make_request() с учётом лимитов чата и бота"""
+        gate = self._chat_gate(chat_id, family)
+        retries = 0
+        while True:
+            queued_at = time.monotonic()
+            await gate.acquire(priority)
+            await self._global.acquire(priority)
+
+            wait_ms = int((time.monotonic() - queued_at) * 1000)
+            bot_stats['outbox_wait_ms_total'] += wait_ms
+            bot_stats['outbox_wait_ms_max'] = max(bot_stats['outbox_wait_ms_max'], wait_ms)
+
+            try:
+                result = await make_request()
+                gate.bucket.on_success()
+                bot_stats['outbox_sent'] += 1
+                return result
+            except TelegramRetryAfter as e:
+                gate.bucket.on_retry_after(e.retry_after)
+                bot_stats['outbox_retry_after'] += 1
+                if retries >= max_retries:
+                    raise
+                retries += 1
+                logging.warning(f"Flood control в чате {chat_id} ({family}), повтор через {e.retry_after} с")
+
+outbox = Outbox()
+
+def queue_depth() -> int:
+    """Глубина очереди исходящих запросов (для /stats)"""
+    return outbox.queue_depth()
+
+def current_rate(chat_id: int, family: str) -> float:
+    return outbox.rate(chat_id, family)
+
+def learned_rates() -> list:
+    """Подобранные частоты по чатам и семействам методов (для /rates)"""
+    return outbox.learned_rates()
+
+async def call(chat_id: int, make_request, priority: int = PRIORITY_DEFAULT,
+               max_retries: int = OUTBOX_MAX_RETRIES, family: str = 'message'):
+    """Произвольный запрос make_request() через очередь исходящих запросов"""
+    return await outbox.call(chat_id, make_request, priority, max_retries, family)
+
+async def send_message(bot: Bot, chat_id: int, priority: int = PRIORITY_DEFAULT, **kwargs):
+    """bot.send_message через очередь исходящих запросов"""
+    return await outbox.call(chat_id, lambda: bot.send_message(chat_id=chat_id, **kwargs), priority)
+
+async def edit_message_text(bot: Bot, chat_id: int, priority: int = PRIORITY_DEFAULT, **kwargs):
+    """bot.edit_message_text через очередь исходящих запросов"""
+    return await outbox.call(chat_id, lambda: bot.edit_message_text(chat_id=chat_id, **kwargs), priority,
+                             family='edit')
+
+async def delete_message(bot: Bot, chat_id: int, priority: int = PRIORITY_DEFAULT, **kwargs):
+    """bot.delete_message через очередь исходящих запросов"""
+    return await outbox.call(chat_id, lambda: bot.delete_message(chat_id=chat_id, **kwargs), priority,
+                             family='edit')
+
+async def broadcast(bot: Bot, targets: list, text: str, priority: int = PRIORITY_BROADCAST) -> dict:
+    """Разослать text в темы targets — список пар (chat_id, topic_id).
+
+    Все отправки ставятся в очередь сразу: внутри чата они идут подряд с
+    предельной для него частотой, разные чаты отправляются параллельно.
+    После TelegramRetryAfter тема не пропускается, а ждёт и отправляется снова.
+    Возвращает отчёт с количеством доставленных, ошибок, повторов и временем.
+    """
+    started = time.monotonic()
+    report = {
+        'total': len(targets),
+        'chats': len({chat_id for chat_id, _ in targets}),
+        'sent': 0,
+        'failed': 0,
+        'retried': 0,
+        'elapsed': 0.0,
+        'max_latency': 0.0,
+        'errors': []
+    }
+
+    async def send_one(chat_id: int, topic_id: int):
+        attempts = 0
+
+        async def request():
+            nonlocal attempts
+            attempts += 1
+            return await bot.send_message(chat_id=chat_id, message_thread_id=topic_id, text=text)
+
+        try:
+            await outbox.call(chat_id, request, priority, max_retries=BULK_MAX_RETRIES)
+            report['sent'] += 1
+        except Exception as e:
+            report['failed'] += 1
+            report['errors'].append((chat_id, topic_id, str(e)))
+            logging.error(f"Ошибка при рассылке в тему {topic_id} чата {chat_id}: {str(e)}")
+        finally:
+            report['retried'] += max(attempts - 1, 0)
+            report['max_latency'] = max(report['max_latency'], time.monotonic() - started)
+
+    await asyncio.gather(*(send_one(chat_id, topic_id) for chat_id, topic_id in targets))
+    report['elapsed'] = time.monotonic() - started
+    bot_stats['broadcasts'] += 1
+    bot_stats['broadcast_messages'] += report['sent']
+    return report
+
+def format_broadcast_report(report: dict) -> str:
+    """Короткий текст отчёта о рассылке для ответа админу"""
+    text = (
+        f"Сообщение отправлено в {report['sent']} из {report['total']} тем "
+        f"за {report['elapsed']:.1f} с"
+    )
+    if report['retried']:
+        text += f"\nПовторов после flood control: {report['retried']}"
+    if report['failed']:
+        text += f"\nНе доставлено: {report['failed']}"
+    return text
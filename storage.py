@@ -0,0 +1,191 @@
+import json
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    DB_PATH, STATE_FLUSH_DELAY, topics_dict, workers_dict, rename_topics_dict, restricted_topics,
+    admin_list, sos_words, chat_sos_words, breaks_dict, support_tickets, active_topics_info,
+    break_id_counter, ticket_id_counter
+)
+
+# Все операции с базой идут через одно долгоживущее соединение в режиме WAL.
+# Соединение используется только из одного потока-исполнителя, поэтому запросы
+# выполняются последовательно и не блокируют event loop.
+_db_conn = None
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+def get_db_connection():
+    """Получить общее соединение с базой (создаётся при первом обращении)"""
+    global _db_conn
+    if _db_conn is None:
+        # cached_statements держит скомпилированные запросы между вызовами
+        _db_conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=64)
+        _db_conn.execute('PRAGMA journal_mode=WAL')
+        _db_conn.execute('PRAGMA synchronous=NORMAL')
+    return _db_conn
+
+async def run_db(func, *args):
+    """Выполнить функцию работы с базой в потоке БД, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, func, *args)
+
+def close_database():
+    """Закрыть соединение с базой"""
+    global _db_conn
+    _db_executor.shutdown(wait=True)
+    if _db_conn is not None:
+        _db_conn.close()
+        _db_conn = None
+
+# Состояние бота (темы, воркеры, ограничения, SOS-слова, перерывы, тикеты)
+# хранится в таблице state: одна строка на чат (или перерыв, тикет) с JSON
+# значением. Обработчики меняют словари из config как раньше и отмечают
+# изменённый ключ через mark_dirty — изменения пишутся пачкой раз в
+# STATE_FLUSH_DELAY секунд.
+SQL_STATE_SELECT_ALL = 'SELECT collection, key, value FROM state'
+SQL_STATE_UPSERT = (
+    'INSERT INTO state (collection, key, value) VALUES (?, ?, ?) '
+    'ON CONFLICT(collection, key) DO UPDATE SET value = excluded.value'
+)
+SQL_STATE_DELETE = 'DELETE FROM state WHERE collection = ? AND key = ?'
+
+WHOLE = 0  # ключ для коллекций, которые хранятся одной строкой
+
+def _int_keys(value: dict) -> dict:
+    return {int(key): item for key, item in value.items()}
+
+def _set_of_ints(value: list) -> set:
+    return set(value)
+
+id_counters = {'break': break_id_counter, 'ticket': ticket_id_counter}
+
+class StateStore:
+    """Сохранение словарей состояния в SQLite с отложенной пакетной записью"""
+
+    def __init__(self, flush_delay: float = STATE_FLUSH_DELAY):
+        self.flush_delay = flush_delay
+        self._collections = {}
+        self._dirty = {}
+        self._flush_task = None
+
+    def register(self, name: str, container, dump=None, load=None, whole: bool = False):
+        """Подключить словарь (или множество) container под именем name.
+
+        dump превращает значение в объект для JSON, load — обратно.
+        whole=True — коллекция хранится целиком одной строкой.
+        """
+        self._collections[name] = (container, dump or (lambda value: value), load or (lambda value: value), whole)
+
+    def load(self):
+        """Загрузить все коллекции из базы, меняя словари config на месте"""
+        started = time.monotonic()
+        conn = get_db_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS state (
+                collection TEXT,
+                key INTEGER,
+                value TEXT,
+                PRIMARY KEY (collection, key)
+            ) WITHOUT ROWID
+        ''')
+        conn.commit()
+
+        rows = 0
+        for name, key, value in conn.execute(SQL_STATE_SELECT_ALL):
+            if name not in self._collections:
+                continue
+            container, _, load, whole = self._collections[name]
+            value = load(json.loads(value))
+            if whole:
+                container.clear()
+                container.update(value)
+            else:
+                container[key] = value
+            rows += 1
+        logging.info(f"Состояние загружено из базы: {rows} записей за {(time.monotonic() - started) * 1000:.1f} мс")
+
+    def mark_dirty(self, name: str, key: int = WHOLE):
+        """Отметить, что значение container[key] (или вся коллекция) изменилось"""
+        self._dirty.setdefault(name, set()).add(key)
+        if self._flush_task is None or self._flush_task.done():
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self._delayed_flush())
+        except RuntimeError:
+            pass  # вне event loop — запишется при следующем flush()
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    def _snapshot(self):
+        # Сериализуем в потоке event loop, пока словари никто не меняет
+        upserts = []
+        deletes = []
+        for name, keys in self._dirty.items():
+            container, dump, _, whole = self._collections[name]
+            if whole:
+                upserts.append((name, WHOLE, json.dumps(dump(container), ensure_ascii=False)))
+                continue
+            for key in keys:
+                if key in container:
+                    upserts.append((name, key, json.dumps(dump(container[key]), ensure_ascii=False)))
+                else:
+                    deletes.append((name, key))
+        dirty, self._dirty = self._dirty, {}
+        return upserts, deletes, dirty
+
+    async def flush(self):
+        """Записать накопленные изменения в базу одной транзакцией"""
+        if not self._dirty:
+            return
+        upserts, deletes, dirty = self._snapshot()
+        try:
+            await run_db(self._write, upserts, deletes)
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении состояния: {str(e)}")
+            # Значения перечитаются из словарей при следующей записи
+            for name, keys in dirty.items():
+                self._dirty.setdefault(name, set()).update(keys)
+        # Изменения, сделанные во время записи, mark_dirty не запланировал —
+        # задача записи ещё не завершилась
+        if self._dirty:
+            self._schedule_flush()
+
+    @staticmethod
+    def _write(upserts: list, deletes: list):
+        conn = get_db_connection()
+        with conn:
+            conn.executemany(SQL_STATE_UPSERT, upserts)
+            conn.executemany(SQL_STATE_DELETE, deletes)
+
+state_store = StateStore()
+state_store.register('topics', topics_dict, load=_int_keys)
+state_store.register('workers', workers_dict, load=_int_keys)
+state_store.register('rename_topics', rename_topics_dict, dump=sorted, load=_set_of_ints)
+state_store.register('restricted_topics', restricted_topics, load=_int_keys)
+state_store.register('chat_sos_words', chat_sos_words, dump=sorted, load=set)
+state_store.register('breaks', breaks_dict)
+state_store.register('support_tickets', support_tickets)
+# Топик и сообщения 'Активные темы': без них после перезапуска создавался бы новый топик
+state_store.register('active_topics_info', active_topics_info)
+state_store.register('admin_list', admin_list, dump=sorted, whole=True)
+state_store.register('sos_words', sos_words, dump=sorted, whole=True)
+state_store.register('id_counters', id_counters, whole=True)
+
+def mark_dirty(name: str, key: int = WHOLE):
+    state_store.mark_dirty(name, key)
+
+def next_id(name: str) -> int:
+    """Выдать следующий номер перерыва или тикета (счётчик переживает перезапуск)"""
+    value = id_counters[name]
+    id_counters[name] = value + 1
+    mark_dirty('id_counters')
+    return value
+
+state_store.load()
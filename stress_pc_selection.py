@@ -0,0 +1,118 @@
+"""Стресс-проверка выбора ПК: сотни одновременных нажатий select_pc_.
+
+Воркеры с готовой сессией переименования одновременно жмут кнопки ПК, по
+нескольку человек на каждый ПК. Все колбэки идут через настоящий Dispatcher с
+заглушкой сессии из bench_router.py. Проверяется, что каждый ПК достался
+ровно одному воркеру: одна переименованная тема на ПК, свободных ПК не
+осталось, в базе все ПК записаны занятыми. Если это не так, скрипт
+возвращает код 1.
+
+Запуск: python stress_pc_selection.py [--workers 600] [--pcs 20]
+"""
+import asyncio
+import argparse
+import logging
+import re
+from collections import Counter
+
+# bench_router до импорта модулей бота подменяет базу на временную и снимает лимиты outbox
+from bench_router import RecordingSession, UpdateFactory, BOT_ID, CHAT_ID, user
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Update
+
+from config import topics_dict, rename_topics_dict
+from handlers import router
+from fsm_storage import SQLiteStorage, RenameSession
+from storage import get_db_connection, run_db
+from utils import pc_pool, sos_expiry, stop_dashboard_ticker, background_tasks
+
+TOPIC_BASE = 1000
+PC_IN_NAME = re.compile(r'\(#ПК(\d+)\)$')
+
+async def prepare(storage: SQLiteStorage, workers: int, pcs: int):
+    """Тема и сессия переименования с уже введённым именем на каждого воркера"""
+    topics_dict[CHAT_ID] = {}
+    rename_topics_dict[CHAT_ID] = set()
+    for i in range(workers):
+        topic_id = TOPIC_BASE + i
+        topics_dict[CHAT_ID][topic_id] = f"{i + 1}:Без названия"
+        rename_topics_dict[CHAT_ID].add(topic_id)
+        session = RenameSession(
+            chat_id=CHAT_ID, topic_id=topic_id,
+            old_name=f"{i + 1}:Без названия", topic_name=f"Работник {i + 1}"
+        )
+        key = StorageKey(bot_id=BOT_ID, chat_id=CHAT_ID, user_id=worker_id(i))
+        await storage.set_data(key, {RenameSession.KEY: session.to_data()})
+    pc_pool.add(pcs)
+
+def worker_id(index: int) -> int:
+    return 10000 + index
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=600)
+    parser.add_argument('--pcs', type=int, default=20)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    session = RecordingSession()
+    bot = Bot(token=f"{BOT_ID}:STRESS", session=session)
+    storage = SQLiteStorage()
+    dp = Dispatcher(storage=storage)
+    dp.include_router(router)
+
+    await prepare(storage, args.workers, args.pcs)
+
+    factory = UpdateFactory()
+    updates = [
+        Update.model_validate(
+            factory.callback(user(worker_id(i)), f'select_pc_{i % args.pcs + 1}', TOPIC_BASE + i),
+            context={'bot': bot}
+        )
+        for i in range(args.workers)
+    ]
+    await asyncio.gather(*(dp.feed_update(bot, update) for update in updates))
+
+    while background_tasks:
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+    sos_expiry.stop()
+    stop_dashboard_ticker()
+    await pc_pool.flush()
+    await storage.close()
+
+    granted = Counter()
+    for name in topics_dict[CHAT_ID].values():
+        match = PC_IN_NAME.search(name)
+        if match:
+            granted[int(match.group(1))] += 1
+    # Через поток БД: запрос встанет в очередь после пакетной записи ПК, если она ещё идёт
+    busy_in_db = await run_db(lambda: get_db_connection().execute(
+        'SELECT COUNT(*) FROM pc_list WHERE NOT is_available'
+    ).fetchone()[0])
+
+    print(f"Нажатий: {args.workers}, ПК: {args.pcs}")
+    print(f"Переименовано тем: {sum(granted.values())}, вызовов editForumTopic: {session.calls['EditForumTopic']}")
+    print(f"Свободных ПК в памяти: {len(pc_pool.available())}, занятых в базе: {busy_in_db}")
+
+    errors = []
+    twice = sorted(pc_id for pc_id, count in granted.items() if count > 1)
+    missing = sorted(set(range(1, args.pcs + 1)) - set(granted))
+    if twice:
+        errors.append(f"ПК выданы больше одного раза: {twice}")
+    if missing:
+        errors.append(f"ПК никому не достались: {missing}")
+    if session.calls['EditForumTopic'] != args.pcs:
+        errors.append(f"editForumTopic вызван {session.calls['EditForumTopic']} раз вместо {args.pcs}")
+    if pc_pool.available() or busy_in_db != args.pcs:
+        errors.append("состояние ПК в памяти или в базе не совпадает с выданными")
+    for error in errors:
+        print(f"ОШИБКА: {error}")
+    if not errors:
+        print("OK: каждый ПК выдан ровно один раз")
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    raise SystemExit(asyncio.run(main()))
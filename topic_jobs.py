@@ -0,0 +1,331 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import outbox
+from outbox import PRIORITY_BROADCAST
+from config import (
+    topics_dict, rename_topics_dict, bot_stats, TOPIC_JOB_PROGRESS_INTERVAL,
+    TOPIC_DELETE_CONCURRENCY, BULK_MAX_RETRIES
+)
+from storage import get_db_connection, run_db, mark_dirty
+from utils import run_in_background, forget_topic
+
+# Задания на массовое создание тем для переименования хранятся в той же базе,
+# что и ПК. Номер следующей темы записывается сразу после её создания, поэтому
+# после перезапуска задание продолжается с того же места и номера не повторяются.
+SQL_JOB_UPSERT = (
+    'INSERT INTO topic_jobs (chat_id, user_id, total, next_index, failed, status, '
+    'progress_message_id) VALUES (?, ?, ?, ?, ?, ?, ?) '
+    'ON CONFLICT(chat_id) DO UPDATE SET next_index = excluded.next_index, '
+    'failed = excluded.failed, status = excluded.status, '
+    'progress_message_id = excluded.progress_message_id'
+)
+SQL_JOB_SELECT_ALL = (
+    'SELECT chat_id, user_id, total, next_index, failed, status, progress_message_id '
+    'FROM topic_jobs'
+)
+SQL_JOB_DELETE = 'DELETE FROM topic_jobs WHERE chat_id = ?'
+
+RENAME_PROMPT = (
+    "🌏 Чтобы задать название темы, сначала укажите своё имя.\n"
+    "ℹ️ Не забудьте нажать на галочку под сообщением"
+)
+
+def init_topic_jobs_table():
+    conn = get_db_connection()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS topic_jobs (
+            chat_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            total INTEGER,
+            next_index INTEGER,
+            failed INTEGER DEFAULT 0,
+            status TEXT,
+            progress_message_id INTEGER
+        )
+    ''')
+    conn.commit()
+
+class TopicJob:
+    """Задание на создание тем 1..total в одном чате"""
+
+    def __init__(self, chat_id: int, user_id: int, total: int, next_index: int = 1, failed: int = 0,
+                 status: str = 'running', progress_message_id: int = None):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.total = total
+        self.next_index = next_index
+        self.failed = failed
+        self.status = status
+        self.progress_message_id = progress_message_id
+        self.task = None
+        self.last_progress = 0.0
+
+    def row(self) -> tuple:
+        return (self.chat_id, self.user_id, self.total, self.next_index, self.failed,
+                self.status, self.progress_message_id)
+
+    @property
+    def created(self) -> int:
+        return self.next_index - 1 - self.failed
+
+
+topic_jobs = {}  # chat_id -> TopicJob
+
+def _save_job(job: TopicJob):
+    conn = get_db_connection()
+    with conn:
+        conn.execute(SQL_JOB_UPSERT, job.row())
+
+def _delete_job(chat_id: int):
+    conn = get_db_connection()
+    with conn:
+        conn.execute(SQL_JOB_DELETE, (chat_id,))
+
+def progress_text(job: TopicJob) -> str:
+    if job.next_index > job.total:
+        text = f"✅ Создано {job.created} тем для переименования."
+    else:
+        text = (
+            f"🖌 Создание тем: {job.next_index - 1} из {job.total}\n"
+            f"Темп: {outbox.current_rate(job.chat_id, 'topic') * 60:.0f} тем в минуту"
+        )
+        if job.status == 'pausing':
+            text += "\n⏳ Останавливаю…"
+        elif job.status == 'paused':
+            text += "\n⏸ Приостановлено"
+    if job.failed:
+        text += f"\nОшибок: {job.failed}"
+    return text
+
+def progress_markup(job: TopicJob):
+    if job.next_index > job.total or job.status == 'pausing':
+        return None
+    if job.status == 'paused':
+        keyboard = [[
+            InlineKeyboardButton(text="▶️ Продолжить", callback_data='topic_job_resume'),
+            InlineKeyboardButton(text="✖️ Отменить", callback_data='topic_job_cancel')
+        ]]
+    else:
+        keyboard = [[InlineKeyboardButton(text="⏸ Пауза", callback_data='topic_job_pause')]]
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+async def update_progress(job: TopicJob, bot: Bot, force: bool = False):
+    """Обновить сообщение о прогрессе (не чаще раза в TOPIC_JOB_PROGRESS_INTERVAL)"""
+    now = time.monotonic()
+    if job.progress_message_id is None:
+        return
+    if not force and now - job.last_progress < TOPIC_JOB_PROGRESS_INTERVAL:
+        return
+    job.last_progress = now
+    try:
+        await outbox.edit_message_text(
+            bot, job.chat_id,
+            message_id=job.progress_message_id,
+            text=progress_text(job),
+            reply_markup=progress_markup(job)
+        )
+    except Exception as e:
+        logging.warning(f"Не удалось обновить прогресс создания тем в чате {job.chat_id}: {str(e)}")
+
+async def _create_topic(job: TopicJob, bot: Bot, index: int):
+    name = f"{index}:Без названия"
+    topic = await outbox.call(
+        job.chat_id,
+        lambda: bot.create_forum_topic(chat_id=job.chat_id, name=name),
+        PRIORITY_BROADCAST,
+        max_retries=0,
+        family='topic'
+    )
+
+    if job.chat_id not in topics_dict:
+        topics_dict[job.chat_id] = {}
+    topics_dict[job.chat_id][topic.message_thread_id] = name
+    rename_topics_dict.setdefault(job.chat_id, set()).add(topic.message_thread_id)
+    mark_dirty('topics', job.chat_id)
+    mark_dirty('rename_topics', job.chat_id)
+    return topic
+
+async def _run_job(job: TopicJob, bot: Bot):
+    while job.next_index <= job.total and job.status == 'running':
+        index = job.next_index
+        try:
+            topic = await _create_topic(job, bot, index)
+        except TelegramRetryAfter:
+            # Тему не пропускаем: очередь уже снизила темп и выждет блокировку,
+            # а мы пробуем этот же номер ещё раз
+            bot_stats['topic_job_retry_after'] += 1
+            await update_progress(job, bot, force=True)
+            continue
+        except Exception as e:
+            logging.error(f"Ошибка при создании темы {index}: {str(e)}")
+            job.failed += 1
+            job.next_index += 1
+            await run_db(_save_job, job)
+            continue
+
+        # Номер занят — сохраняем до любых других запросов
+        job.next_index += 1
+        await run_db(_save_job, job)
+        bot_stats['topic_job_created'] += 1
+
+        keyboard = [[InlineKeyboardButton(text="✅", callback_data=f'confirm_rename_{topic.message_thread_id}')]]
+        try:
+            await outbox.send_message(
+                bot, job.chat_id,
+                message_thread_id=topic.message_thread_id,
+                text=RENAME_PROMPT,
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+            )
+        except Exception as e:
+            logging.error(f"Ошибка при отправке сообщения в тему {topic.message_thread_id}: {str(e)}")
+
+        await update_progress(job, bot)
+
+    if job.next_index > job.total:
+        topic_jobs.pop(job.chat_id, None)
+        await run_db(_delete_job, job.chat_id)
+    await update_progress(job, bot, force=True)
+
+def _start(job: TopicJob, bot: Bot) -> bool:
+    # Второй _run_job на том же next_index создал бы темы с повторными номерами
+    if job.task is not None and not job.task.done():
+        return False
+    job.status = 'running'
+    job.task = run_in_background(_run_job(job, bot))
+    return True
+
+async def start_topic_job(bot: Bot, chat_id: int, user_id: int, total: int):
+    """Запустить создание total тем. Возвращает None, если в чате уже есть задание"""
+    if chat_id in topic_jobs:
+        return None
+
+    job = TopicJob(chat_id, user_id, total)
+    topic_jobs[chat_id] = job
+    try:
+        progress = await outbox.send_message(
+            bot, chat_id, text=progress_text(job), reply_markup=progress_markup(job)
+        )
+        job.progress_message_id = progress.message_id
+    except Exception as e:
+        logging.warning(f"Не удалось отправить прогресс создания тем в чат {chat_id}: {str(e)}")
+
+    await run_db(_save_job, job)
+    _start(job, bot)
+    return job
+
+async def pause_topic_job(chat_id: int, bot: Bot) -> bool:
+    job = topic_jobs.get(chat_id)
+    if job is None or job.status != 'running':
+        return False
+    # Пока текущая тема создаётся и записывается, задание в статусе 'pausing':
+    # продолжить его можно только после остановки
+    job.status = 'pausing'
+    if job.task is not None:
+        await job.task
+    job.status = 'paused'
+    await run_db(_save_job, job)
+    await update_progress(job, bot, force=True)
+    return True
+
+async def resume_topic_job(chat_id: int, bot: Bot) -> bool:
+    job = topic_jobs.get(chat_id)
+    if job is None or job.status != 'paused' or not _start(job, bot):
+        return False
+    await run_db(_save_job, job)
+    await update_progress(job, bot, force=True)
+    return True
+
+async def cancel_topic_job(chat_id: int, bot: Bot) -> bool:
+    job = topic_jobs.get(chat_id)
+    if job is None:
+        return False
+    if job.status == 'running':
+        await pause_topic_job(chat_id, bot)
+    elif job.task is not None and not job.task.done():
+        await job.task  # пауза уже идёт
+    topic_jobs.pop(chat_id, None)
+    await run_db(_delete_job, chat_id)
+    if job.progress_message_id is not None:
+        try:
+            await outbox.edit_message_text(
+                bot, chat_id,
+                message_id=job.progress_message_id,
+                text=f"✖️ Создание тем отменено: создано {job.created} из {job.total}"
+            )
+        except Exception as e:
+            logging.warning(f"Не удалось обновить прогресс создания тем в чате {chat_id}: {str(e)}")
+    return True
+
+def resume_topic_jobs(bot: Bot):
+    """Загрузить задания из базы при старте и продолжить незавершённые"""
+    for row in get_db_connection().execute(SQL_JOB_SELECT_ALL).fetchall():
+        job = TopicJob(*row)
+        if job.status == 'pausing':
+            job.status = 'paused'
+        topic_jobs[job.chat_id] = job
+        if job.status == 'running':
+            _start(job, bot)
+            logging.info(f"Продолжено создание тем в чате {job.chat_id} с номера {job.next_index}")
+
+def _topic_is_gone(error: Exception) -> bool:
+    """Тема уже удалена кем-то другим — для нас это тоже успех"""
+    text = str(error).lower()
+    return 'topic_id_invalid' in text or 'thread not found' in text
+
+async def delete_topics(bot: Bot, chat_id: int, topic_ids: list, progress_message_id: int = None) -> dict:
+    """Удалить темы topic_ids, держа в работе не больше TOPIC_DELETE_CONCURRENCY запросов.
+
+    Каждая тема убирается из словарей бота сразу после удаления, поэтому при
+    сбое посередине в памяти остаются ровно те темы, что остались в группе.
+    Возвращает отчёт: total, deleted, failed, elapsed.
+    """
+    started = time.monotonic()
+    report = {'total': len(topic_ids), 'deleted': 0, 'failed': 0, 'elapsed': 0.0}
+    semaphore = asyncio.Semaphore(TOPIC_DELETE_CONCURRENCY)
+    last_progress = started
+
+    async def show_progress():
+        nonlocal last_progress
+        now = time.monotonic()
+        if progress_message_id is None or now - last_progress < TOPIC_JOB_PROGRESS_INTERVAL:
+            return
+        last_progress = now
+        try:
+            await outbox.edit_message_text(
+                bot, chat_id,
+                message_id=progress_message_id,
+                text=f"🗑 Удаление тем: {report['deleted'] + report['failed']} из {report['total']}"
+            )
+        except Exception as e:
+            logging.warning(f"Не удалось обновить прогресс удаления тем в чате {chat_id}: {str(e)}")
+
+    async def delete_one(topic_id: int):
+        async with semaphore:
+            try:
+                await outbox.call(
+                    chat_id,
+                    lambda: bot.delete_forum_topic(chat_id=chat_id, message_thread_id=topic_id),
+                    max_retries=BULK_MAX_RETRIES,
+                    family='topic'
+                )
+            except Exception as e:
+                if not _topic_is_gone(e):
+                    report['failed'] += 1
+                    logging.error(f"Ошибка при удалении темы {topic_id}: {str(e)}")
+                    return
+            forget_topic(chat_id, topic_id, bot)
+            report['deleted'] += 1
+        await show_progress()
+
+    await asyncio.gather(*(delete_one(topic_id) for topic_id in topic_ids))
+    report['elapsed'] = time.monotonic() - started
+    bot_stats['topics_deleted'] += report['deleted']
+    return report
+
+init_topic_jobs_table()
@@ -1,81 +1,399 @@
 
 #hello
 
-import sqlite3
+import re
+import heapq
 import asyncio
 import logging
 import time
 from datetime import datetime, time as time_obj
 from aiogram import Bot
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+import outbox
+from outbox import PRIORITY_ALERT, PRIORITY_DASHBOARD
+from storage import get_db_connection, run_db, mark_dirty
 from config import (
     topics_dict, active_topics, active_topics_info, sos_activation_times,
-    sos_removal_tasks, sos_update_tasks, workers_dict, ADMIN_ID, KYIV_TZ
+    workers_dict, rename_topics_dict, restricted_topics, ADMIN_ID, KYIV_TZ,
+    CHAT_INFO_TTL, ADMIN_ROSTER_TTL, USERNAME_RETRY_BASE, USERNAME_RETRY_MAX,
+    WORKER_NOTIFY_CONCURRENCY, SOS_WORD_BOUNDARY,
+    DASHBOARD_EDIT_INTERVAL, SOS_REFRESH_INTERVAL, DASHBOARD_TICKER_MAX_RATE,
+    DASHBOARD_SHARD_LIMIT, DASHBOARD_CONTINUATION,
+    sos_words, chat_sos_words, chat_info_cache, chat_admins_cache,
+    username_ids, username_misses, bot_stats
 )
 
-# Database functions
+# База ПК. Соединение и поток БД общие с хранилищем состояния (storage.py)
+SQL_SELECT_ALL = 'SELECT id, is_available FROM pc_list ORDER BY id'
+SQL_UPSERT = (
+    'INSERT INTO pc_list (id, is_available) VALUES (?, ?) '
+    'ON CONFLICT(id) DO UPDATE SET is_available = excluded.is_available'
+)
+SQL_CLEAR = 'DELETE FROM pc_list'
+
 def init_pc_database():
-    conn = sqlite3.connect('pc_database.db')
-    cursor = conn.cursor()
-    cursor.execute('''
+    conn = get_db_connection()
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS pc_list (
             id INTEGER PRIMARY KEY,
             is_available BOOLEAN DEFAULT TRUE
         )
     ''')
     conn.commit()
-    conn.close()
-
-def get_available_pcs():
-    """Получить список доступных ПК"""
-    conn = sqlite3.connect('pc_database.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id FROM pc_list WHERE is_available = TRUE ORDER BY id')
-    result = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return result
-
-def take_pc(pc_id):
-    """Занять ПК"""
-    conn = sqlite3.connect('pc_database.db')
-    cursor = conn.cursor()
-    cursor.execute('UPDATE pc_list SET is_available = FALSE WHERE id = ?', (pc_id,))
-    conn.commit()
-    conn.close()
 
-def release_pc(pc_id):
-    """Освободить ПК"""
-    conn = sqlite3.connect('pc_database.db')
-    cursor = conn.cursor()
-    cursor.execute('UPDATE pc_list SET is_available = TRUE WHERE id = ?', (pc_id,))
-    conn.commit()
-    conn.close()
-
-def add_pcs(count):
-    """Добавить ПК в базу"""
-    conn = sqlite3.connect('pc_database.db')
-    cursor = conn.cursor()
-    for i in range(1, count + 1):
-        cursor.execute('INSERT OR IGNORE INTO pc_list (id, is_available) VALUES (?, TRUE)', (i,))
-    conn.commit()
-    conn.close()
-
-def clear_all_pcs():
-    """Очистить все ПК"""
-    conn = sqlite3.connect('pc_database.db')
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM pc_list')
-    conn.commit()
-    conn.close()
+class PcPool:
+    """Состояние ПК в памяти с отложенной пакетной записью в SQLite.
+
+    Номер ПК — это номер бита: в _known отмечены существующие ПК, в _free — свободные.
+    Все проверки и изменения выполняются в памяти, а база обновляется пачкой
+    через flush_delay секунд после первого изменения.
+    """
+
+    def __init__(self, flush_delay: float = 0.5):
+        self.flush_delay = flush_delay
+        self._known = 0
+        self._free = 0
+        self._pending = {}
+        self._clear_pending = False
+        self._flush_task = None
+
+    def load(self):
+        """Загрузить состояние ПК из базы (вызывается один раз при старте)"""
+        self._known = 0
+        self._free = 0
+        for pc_id, is_available in get_db_connection().execute(SQL_SELECT_ALL):
+            self._known |= 1 << pc_id
+            if is_available:
+                self._free |= 1 << pc_id
+
+    @staticmethod
+    def _bits_to_ids(bits: int) -> list:
+        result = []
+        while bits:
+            lowest = bits & -bits
+            result.append(lowest.bit_length() - 1)
+            bits ^= lowest
+        return result
+
+    def available(self) -> list:
+        """Список свободных ПК по возрастанию номера"""
+        return self._bits_to_ids(self._free)
+
+    def all(self) -> list:
+        """Все ПК в виде списка (id, is_available)"""
+        return [(pc_id, self.is_free(pc_id)) for pc_id in self._bits_to_ids(self._known)]
+
+    def first_free(self):
+        """Наименьший номер свободного ПК или None"""
+        if not self._free:
+            return None
+        return (self._free & -self._free).bit_length() - 1
+
+    def is_free(self, pc_id: int) -> bool:
+        return pc_id >= 0 and bool(self._free >> pc_id & 1)
+
+    def reserve(self, pc_id: int) -> bool:
+        """Занять ПК, если он свободен. Возвращает True, если ПК достался нам"""
+        if not self.is_free(pc_id):
+            return False
+        self._free &= ~(1 << pc_id)
+        self._mark_changed(pc_id, False)
+        return True
+
+    def release(self, pc_id: int):
+        """Освободить ПК"""
+        if pc_id < 0 or not self._known >> pc_id & 1:
+            return
+        self._free |= 1 << pc_id
+        self._mark_changed(pc_id, True)
+
+    def add(self, count: int):
+        """Добавить ПК с номерами 1..count (уже существующие не меняются)"""
+        for pc_id in range(1, count + 1):
+            if not self._known >> pc_id & 1:
+                self._known |= 1 << pc_id
+                self._free |= 1 << pc_id
+                self._mark_changed(pc_id, True)
+
+    def clear(self):
+        """Удалить все ПК"""
+        self._known = 0
+        self._free = 0
+        self._pending.clear()
+        self._clear_pending = True
+        self._schedule_flush()
+
+    def _mark_changed(self, pc_id: int, is_available: bool):
+        self._pending[pc_id] = is_available
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    async def flush(self):
+        """Записать накопленные изменения в базу одной транзакцией"""
+        if not self._pending and not self._clear_pending:
+            return
+        changes = list(self._pending.items())
+        clear = self._clear_pending
+        self._pending = {}
+        self._clear_pending = False
+        try:
+            await run_db(self._write, changes, clear)
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении состояния ПК: {str(e)}")
+            # Возвращаем неудавшиеся изменения, если их не перекрыла более
+            # поздняя очистка или новое состояние того же ПК
+            if not self._clear_pending:
+                self._clear_pending = clear
+                for pc_id, is_available in changes:
+                    self._pending.setdefault(pc_id, is_available)
+        # Изменения, сделанные во время записи, _schedule_flush не запланировал —
+        # задача записи ещё не завершилась
+        if self._pending or self._clear_pending:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    @staticmethod
+    def _write(changes: list, clear: bool):
+        conn = get_db_connection()
+        with conn:
+            if clear:
+                conn.execute(SQL_CLEAR)
+            conn.executemany(SQL_UPSERT, changes)
+
+pc_pool = PcPool()
+
+class SosMatcher:
+    """Поиск SOS-слов одним скомпилированным регулярным выражением.
+
+    Выражение пересобирается только при изменении списка слов (/gadd, /gdel),
+    а проверка сообщения — один проход по тексту.
+    """
+
+    def __init__(self, words, word_boundary: bool = False):
+        self.words = set(words)
+        self.word_boundary = word_boundary
+        self._pattern = None
+        self._compile()
+
+    @staticmethod
+    def _trie_pattern(words) -> str:
+        # Слова собираются в префиксное дерево, и общие префиксы попадают в выражение
+        # один раз, поэтому скорость поиска почти не зависит от количества слов
+        trie = {}
+        for word in words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[''] = {}
+
+        def build(node):
+            if list(node) == ['']:
+                return ''
+            branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+            body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+            if '' in node:
+                body = '(?:' + body + ')?'
+            return body
+
+        return build(trie)
+
+    def _compile(self):
+        if not self.words:
+            self._pattern = None
+            return
+        alternatives = self._trie_pattern(self.words)
+        if self.word_boundary:
+            alternatives = rf'(?<!\w)(?:{alternatives})(?!\w)'
+        self._pattern = re.compile(alternatives)
+
+    def add(self, word: str):
+        if word not in self.words:
+            self.words.add(word)
+            self._compile()
+
+    def remove(self, word: str):
+        if word in self.words:
+            self.words.discard(word)
+            self._compile()
+
+    def search(self, text: str):
+        """Вернуть найденное SOS-слово или None (text должен быть в нижнем регистре)"""
+        if self._pattern is None:
+            return None
+        match = self._pattern.search(text)
+        return match.group(0) if match else None
+
+# Матчер общего списка и матчеры чатов со своим списком слов
+default_sos_matcher = SosMatcher(sos_words, SOS_WORD_BOUNDARY)
+chat_sos_matchers = {}
+
+def get_sos_words(chat_id: int) -> set:
+    """SOS-слова чата (общий список, если у чата нет своего)"""
+    return chat_sos_words.get(chat_id, sos_words)
+
+def get_sos_matcher(chat_id: int) -> SosMatcher:
+    """Скомпилированный матчер SOS-слов для чата"""
+    matcher = chat_sos_matchers.get(chat_id)
+    if matcher is not None:
+        return matcher
+    if chat_id in chat_sos_words:
+        matcher = SosMatcher(chat_sos_words[chat_id], SOS_WORD_BOUNDARY)
+        chat_sos_matchers[chat_id] = matcher
+        return matcher
+    return default_sos_matcher
+
+def _own_sos_words(chat_id):
+    # При первом изменении чат получает собственную копию общего списка
+    if chat_id is None:
+        return sos_words, default_sos_matcher
+    if chat_id not in chat_sos_words:
+        chat_sos_words[chat_id] = set(sos_words)
+        chat_sos_matchers.pop(chat_id, None)
+    return chat_sos_words[chat_id], get_sos_matcher(chat_id)
+
+def _mark_sos_words_dirty(chat_id):
+    if chat_id is None:
+        mark_dirty('sos_words')
+    else:
+        mark_dirty('chat_sos_words', chat_id)
+
+def add_sos_word(chat_id, word: str) -> bool:
+    """Добавить SOS-слово в список чата (chat_id=None — в общий список)"""
+    if word in (sos_words if chat_id is None else get_sos_words(chat_id)):
+        return False
+    words, matcher = _own_sos_words(chat_id)
+    words.add(word)
+    matcher.add(word)
+    _mark_sos_words_dirty(chat_id)
+    return True
+
+def remove_sos_word(chat_id, word: str) -> bool:
+    """Удалить SOS-слово из списка чата (chat_id=None — из общего списка)"""
+    if word not in (sos_words if chat_id is None else get_sos_words(chat_id)):
+        return False
+    words, matcher = _own_sos_words(chat_id)
+    words.discard(word)
+    matcher.remove(word)
+    _mark_sos_words_dirty(chat_id)
+    return True
 
 # Helper functions
+async def get_chat_info(chat_id: int, bot: Bot):
+    """Получить информацию о чате (username, is_forum, title, type) с кэшированием"""
+    cached = chat_info_cache.get(chat_id)
+    now = time.monotonic()
+    if cached and cached[0] > now:
+        bot_stats['chat_cache_hits'] += 1
+        return cached[1]
+
+    bot_stats['chat_cache_misses'] += 1
+    chat = await bot.get_chat(chat_id)
+    chat_info_cache[chat_id] = (now + CHAT_INFO_TTL, chat)
+    return chat
+
+def invalidate_chat_info(chat_id: int):
+    """Сбросить кэш информации о чате"""
+    chat_info_cache.pop(chat_id, None)
+
+def build_topic_link(chat, topic_id: int) -> str:
+    """Ссылка на тему в чате"""
+    if chat.username:
+        return f"https://t.me/{chat.username}/{topic_id}"
+    # Для приватных чатов используем другой формат
+    return f"https://t.me/c/{str(chat.id)[4:]}/{topic_id}"
+
 async def check_forum_support(chat_id: int, bot: Bot) -> bool:
     try:
-        chat = await bot.get_chat(chat_id)
+        chat = await get_chat_info(chat_id, bot)
         return chat.is_forum
     except Exception:
         return False
 
+# Запросы списка администраторов, которые сейчас выполняются. Параллельные
+# вызовы для одного чата (например, уведомления нескольким воркерам при SOS)
+# ждут один и тот же запрос, а не отправляют каждый свой
+_admin_requests = {}
+
+async def get_chat_admin_ids(chat_id: int, bot: Bot) -> set:
+    """Получить множество ID администраторов чата с кэшированием"""
+    cached = chat_admins_cache.get(chat_id)
+    now = time.monotonic()
+    if cached and cached[0] > now:
+        bot_stats['admin_cache_hits'] += 1
+        return cached[1]
+
+    task = _admin_requests.get(chat_id)
+    if task is None:
+        bot_stats['admin_cache_misses'] += 1
+        task = asyncio.create_task(_fetch_chat_admin_ids(chat_id, bot))
+        _admin_requests[chat_id] = task
+        task.add_done_callback(lambda done: _admin_requests.pop(chat_id, None)
+                               if _admin_requests.get(chat_id) is done else None)
+    else:
+        bot_stats['admin_cache_hits'] += 1
+    # shield: отмена одного из ожидающих не должна отменять общий запрос
+    return await asyncio.shield(task)
+
+async def _fetch_chat_admin_ids(chat_id: int, bot: Bot) -> set:
+    admins = await bot.get_chat_administrators(chat_id)
+    admin_ids = set()
+    for admin in admins:
+        admin_ids.add(admin.user.id)
+        remember_user(admin.user)
+    # Если кэш сбросили, пока шёл запрос, ответ мог устареть — не кэшируем его
+    if _admin_requests.get(chat_id) is asyncio.current_task():
+        chat_admins_cache[chat_id] = (time.monotonic() + ADMIN_ROSTER_TTL, admin_ids)
+    return admin_ids
+
+def invalidate_chat_admins(chat_id: int):
+    """Сбросить кэш администраторов чата"""
+    chat_admins_cache.pop(chat_id, None)
+    _admin_requests.pop(chat_id, None)
+
+def remember_user(user):
+    """Запомнить соответствие username → user_id"""
+    if user and user.username:
+        key = user.username.lower()
+        username_ids[key] = user.id
+        username_misses.pop(key, None)
+
+async def resolve_username(chat_id: int, username: str, bot: Bot):
+    """Найти user_id по username (с @ или без). Возвращает None, если пользователь неизвестен"""
+    key = username.lstrip('@').lower()
+    user_id = username_ids.get(key)
+    if user_id:
+        bot_stats['username_hits'] += 1
+        return user_id
+
+    # Недавно не нашли — не повторяем поиск до истечения паузы
+    now = time.monotonic()
+    miss = username_misses.get(key)
+    if miss and miss[0] > now:
+        bot_stats['username_negative_hits'] += 1
+        return None
+
+    # Ищем среди администраторов чата (список кэшируется, пользователи запоминаются при загрузке)
+    try:
+        await get_chat_admin_ids(chat_id, bot)
+    except Exception as e:
+        logging.warning(f"Не удалось получить администраторов чата {chat_id}: {str(e)}")
+
+    user_id = username_ids.get(key)
+    if user_id:
+        return user_id
+
+    failures = miss[1] + 1 if miss else 1
+    delay = min(USERNAME_RETRY_BASE * 2 ** (failures - 1), USERNAME_RETRY_MAX)
+    username_misses[key] = (now + delay, failures)
+    bot_stats['username_misses'] += 1
+    return None
+
 async def is_admin(chat_id: int, user_id: int, bot: Bot) -> bool:
     try:
         # Проверяем, является ли пользователь главным админом
@@ -87,39 +405,133 @@ async def is_admin(chat_id: int, user_id: int, bot: Bot) -> bool:
         if user_id in admin_list:
             return True
 
-        # Проверяем статус в чате
-        chat_member = await bot.get_chat_member(chat_id, user_id)
-        return chat_member.status in ['creator', 'administrator']
+        # В личных чатах администраторов нет
+        if chat_id > 0:
+            return False
+
+        # Проверяем статус в чате по кэшированному списку администраторов
+        return user_id in await get_chat_admin_ids(chat_id, bot)
     except Exception:
         return False
 
-def clear_rename_context(data: dict):
-    """Очищает контекст переименования"""
-    data.pop('current_rename_topic', None)
-    data.pop('confirmation_message_id', None)
-    data.pop('request_name_message_id', None)
-    data.pop('pc_selection_message_id', None)
-    data.pop('topic_name', None)
-    data.pop('waiting_for_rename', None)
+# Фоновые задачи держим в множестве, чтобы их не собрал сборщик мусора
+background_tasks = set()
+
+def run_in_background(coro):
+    """Запустить корутину фоновой задачей"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def _notify_worker(chat_id: int, topic_id: int, worker: str, notification_text: str,
+                         bot: Bot, semaphore: asyncio.Semaphore):
+    # Убираем @ из упоминания пользователя, если есть
+    username = worker.replace('@', '') if worker.startswith('@') else worker
+    group_text = f"🚨 ВНИМАНИЕ! {worker} - нужен номер!"
+
+    async with semaphore:
+        try:
+            user_id = await resolve_username(chat_id, username, bot)
+
+            if user_id:
+                # Пытаемся отправить ЛС
+                await outbox.send_message(
+                    bot, user_id, PRIORITY_ALERT,
+                    text=notification_text,
+                    disable_web_page_preview=True
+                )
+                logging.info(f"Отправлено ЛС воркеру {worker} (ID: {user_id})")
+                return
+
+            logging.info(f"Не удалось найти user_id для {worker}, отправляем в группу")
+        except Exception as dm_error:
+            # Если не удалось отправить ЛС (пользователь не начинал диалог с ботом)
+            logging.warning(f"Не удалось отправить ЛС воркеру {worker}: {str(dm_error)}")
+
+        # Отправляем в группу как fallback
+        try:
+            await outbox.send_message(
+                bot, chat_id, PRIORITY_ALERT,
+                message_thread_id=topic_id,
+                text=group_text,
+                disable_web_page_preview=True
+            )
+            logging.info(f"Отправлено в группу как fallback для {worker}")
+        except Exception as e:
+            logging.error(f"Общая ошибка при отправке уведомления воркеру {worker}: {str(e)}")
+
+async def notify_workers(chat_id: int, topic_id: int, workers: list, bot: Bot, sos_started_at: float):
+    """Разослать воркерам темы уведомления о SOS с ограничением параллельности.
+
+    Частоту сообщений каждому получателю ограничивает очередь outbox.
+    """
+    try:
+        topic_name = topics_dict.get(chat_id, {}).get(topic_id, f"Тема {topic_id}")
+        chat = await get_chat_info(chat_id, bot)
+        link = build_topic_link(chat, topic_id)
+        notification_text = (
+            f"🚨 ВНИМАНИЕ! Нужен номер в теме '{topic_name}'\n"
+            f"Ссылка: {link}"
+        )
+
+        semaphore = asyncio.Semaphore(WORKER_NOTIFY_CONCURRENCY)
+        await asyncio.gather(*(
+            _notify_worker(chat_id, topic_id, worker, notification_text, bot, semaphore)
+            for worker in workers
+        ))
+
+        # Время от SOS до последнего доставленного уведомления
+        elapsed_ms = int((time.monotonic() - sos_started_at) * 1000)
+        bot_stats['sos_notify_jobs'] += 1
+        bot_stats['sos_notify_last_ms'] = elapsed_ms
+        bot_stats['sos_notify_total_ms'] += elapsed_ms
+        logging.info(f"Отправлены уведомления воркерам для темы {topic_id} за {elapsed_ms} мс")
+
+    except Exception as e:
+        logging.error(f"Ошибка при отправке уведомлений воркерам: {str(e)}")
+
+# Создание топика 'Активные темы', которое сейчас выполняется: SOS из разных
+# тем, пришедшие во время создания, ждут его, а не создают второй топик.
+# Если топик создан, а первое сообщение не отправилось, его номер хранится
+# в _dashboard_unsent, и следующая попытка только досылает сообщение
+_dashboard_creating = {}
+_dashboard_unsent = {}
 
 async def create_active_topics_thread(chat_id: int, bot: Bot):
     """Создает топик 'Активные темы' если его нет"""
+    if chat_id in active_topics_info:
+        return active_topics_info[chat_id]['topic_id']
+    task = _dashboard_creating.get(chat_id)
+    if task is None:
+        task = asyncio.create_task(_create_active_topics_thread(chat_id, bot))
+        _dashboard_creating[chat_id] = task
+        task.add_done_callback(lambda _: _dashboard_creating.pop(chat_id, None))
+    return await asyncio.shield(task)
+
+async def _create_active_topics_thread(chat_id: int, bot: Bot):
     try:
-        # Проверяем, есть ли уже такой топик
-        if chat_id in active_topics_info:
-            return active_topics_info[chat_id]['topic_id']
-
-        # Создаем новый топик
-        topic = await bot.create_forum_topic(
-            chat_id=chat_id,
-            name="Активные темы"
-        )
-
-        topic_id = topic.message_thread_id
+        topic_id = _dashboard_unsent.get(chat_id)
+        if topic_id is None:
+            # Создаем новый топик через очередь: при flood control она выждет и повторит
+            topic = await outbox.call(
+                chat_id,
+                lambda: bot.create_forum_topic(chat_id=chat_id, name="Активные темы"),
+                PRIORITY_DASHBOARD,
+                family='topic'
+            )
+            topic_id = topic.message_thread_id
+            _dashboard_unsent[chat_id] = topic_id
+
+            # Добавляем в общий словарь тем
+            if chat_id not in topics_dict:
+                topics_dict[chat_id] = {}
+            topics_dict[chat_id][topic_id] = "Активные темы"
+            mark_dirty('topics', chat_id)
 
         # Отправляем первое сообщение
-        message = await bot.send_message(
-            chat_id=chat_id,
+        message = await outbox.send_message(
+            bot, chat_id, PRIORITY_DASHBOARD,
             message_thread_id=topic_id,
             text="Темы в которых нужен номер:\n(пока нет активных тем)"
         )
@@ -127,13 +539,12 @@ async def create_active_topics_thread(chat_id: int, bot: Bot):
         # Сохраняем информацию
         active_topics_info[chat_id] = {
             'topic_id': topic_id,
-            'message_id': message.message_id
+            'message_id': message.message_id,
+            'extra_message_ids': []
         }
-
-        # Добавляем в общий словарь тем
-        if chat_id not in topics_dict:
-            topics_dict[chat_id] = {}
-        topics_dict[chat_id][topic_id] = "Активные темы"
+        mark_dirty('active_topics_info', chat_id)
+        _dashboard_unsent.pop(chat_id, None)
+        _dashboard_hashes[chat_id] = [hash(message.text)]
 
         logging.info(f"Создан топик 'Активные темы' с ID {topic_id}")
         return topic_id
@@ -142,115 +553,337 @@ async def create_active_topics_thread(chat_id: int, bot: Bot):
         logging.error(f"Ошибка при создании топика 'Активные темы': {str(e)}")
         return None
 
+# Планировщик правок дашборда: запросы на обновление копятся, а правка
+# выполняется не чаще раза в DASHBOARD_EDIT_INTERVAL секунд на чат.
+# На чат работает не больше одной задачи: запросы, пришедшие во время правки,
+# только отмечают чат в _dashboard_dirty, и после правки задача делает ещё одну.
+# Для каждой части дашборда хранится хэш последнего отправленного текста.
+_dashboard_pending = {}
+_dashboard_dirty = set()
+_dashboard_last_edit = {}
+_dashboard_hashes = {}
+
+def request_dashboard_update(chat_id: int, bot: Bot):
+    """Запросить обновление сообщения 'Активные темы' (правки объединяются)"""
+    task = _dashboard_pending.get(chat_id)
+    if task is not None and not task.done():
+        _dashboard_dirty.add(chat_id)
+        bot_stats['dashboard_coalesced'] += 1
+        return
+    _dashboard_pending[chat_id] = asyncio.create_task(_flush_dashboard(chat_id, bot))
+
+async def _flush_dashboard(chat_id: int, bot: Bot):
+    try:
+        while True:
+            wait = _dashboard_last_edit.get(chat_id, 0) + DASHBOARD_EDIT_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # Запросы до этого места войдут в текущую правку
+            _dashboard_dirty.discard(chat_id)
+            await update_active_topics_message(chat_id, bot)
+            # Интервал отсчитывается от конца правки: медленная правка (например,
+            # ожидание после RetryAfter) не должна сразу смениться следующей
+            _dashboard_last_edit[chat_id] = time.monotonic()
+            if chat_id not in _dashboard_dirty:
+                break
+    finally:
+        _dashboard_pending.pop(chat_id, None)
+        _dashboard_dirty.discard(chat_id)
+
+# Неизменная часть строки дашборда (название и ссылка) для каждой активной темы.
+# Запись пересчитывается при переименовании темы или смене username чата
+# и удаляется при снятии SOS.
+_dashboard_line_cache = {}
+
+def _dashboard_line_parts(chat_id: int, chat, topic_id: int):
+    topic_name = topics_dict.get(chat_id, {}).get(topic_id, f"Тема {topic_id}")
+    cached = _dashboard_line_cache.get((chat_id, topic_id))
+    if cached and cached[0] == topic_name and cached[1] == chat.username:
+        return cached[2], cached[3]
+
+    prefix = f"• {topic_name} "
+    suffix = f" - {build_topic_link(chat, topic_id)}\n"
+    _dashboard_line_cache[(chat_id, topic_id)] = (topic_name, chat.username, prefix, suffix)
+    return prefix, suffix
+
+def format_idle_time(activation_time) -> str:
+    """Время простоя темы с момента SOS"""
+    if not activation_time:
+        return "(время неизвестно)"
+
+    elapsed_seconds = int(time.time() - activation_time)
+    if elapsed_seconds < 60:
+        return f"({elapsed_seconds} секунд простой)"
+
+    minutes = elapsed_seconds // 60
+    seconds = elapsed_seconds % 60
+    if seconds > 0:
+        return f"({minutes} минут {seconds} секунд простой)"
+    return f"({minutes} минут простой)"
+
+def split_dashboard(header: str, lines: list) -> list:
+    """Разбить текст дашборда на части, каждая из которых помещается в одно сообщение"""
+    shards = []
+    parts = [header]
+    length = len(header)
+    for line in lines:
+        if length + len(line) > DASHBOARD_SHARD_LIMIT:
+            shards.append("".join(parts))
+            parts = [DASHBOARD_CONTINUATION]
+            length = len(DASHBOARD_CONTINUATION)
+        parts.append(line)
+        length += len(line)
+    shards.append("".join(parts))
+    return shards
+
+async def _sync_dashboard_shards(chat_id: int, shards: list, bot: Bot):
+    # Первая часть — исходное сообщение топика, остальные досылаются отдельными сообщениями.
+    # Правятся только части, текст которых изменился.
+    info = active_topics_info[chat_id]
+    extra_message_ids = info.setdefault('extra_message_ids', [])
+    message_ids = [info['message_id']] + extra_message_ids
+    hashes = _dashboard_hashes.setdefault(chat_id, [])
+    hashes.extend([None] * (len(shards) - len(hashes)))
+
+    for index, text in enumerate(shards):
+        text_hash = hash(text)
+        if hashes[index] == text_hash:
+            bot_stats['dashboard_unchanged'] += 1
+            continue
+
+        try:
+            if index < len(message_ids):
+                await outbox.edit_message_text(
+                    bot, chat_id, PRIORITY_DASHBOARD,
+                    message_id=message_ids[index],
+                    text=text,
+                    disable_web_page_preview=True
+                )
+            else:
+                message = await outbox.send_message(
+                    bot, chat_id, PRIORITY_DASHBOARD,
+                    message_thread_id=info['topic_id'],
+                    text=text,
+                    disable_web_page_preview=True
+                )
+                extra_message_ids.append(message.message_id)
+                mark_dirty('active_topics_info', chat_id)
+            hashes[index] = text_hash
+            bot_stats['dashboard_edits'] += 1
+        except Exception as e:
+            # Часть будет отправлена заново при следующем обновлении
+            hashes[index] = None
+            logging.error(f"Ошибка при обновлении части {index + 1} сообщения 'Активные темы': {str(e)}")
+            if index >= len(message_ids):
+                break
+
+    # Удаляем части, которые больше не нужны
+    surplus = extra_message_ids[len(shards) - 1:]
+    if surplus:
+        del extra_message_ids[len(shards) - 1:]
+        mark_dirty('active_topics_info', chat_id)
+    del hashes[len(shards):]
+    for message_id in surplus:
+        try:
+            await outbox.delete_message(bot, chat_id, PRIORITY_DASHBOARD, message_id=message_id)
+        except Exception as e:
+            logging.error(f"Ошибка при удалении лишней части 'Активные темы': {str(e)}")
+
 async def update_active_topics_message(chat_id: int, bot: Bot):
     """Обновляет сообщение в топике 'Активные темы'"""
     try:
-        # Проверяем, есть ли топик "Активные темы"
-        if chat_id not in active_topics_info:
-            await create_active_topics_thread(chat_id, bot)
-
+        # Топик "Активные темы" создаёт только check_sos_word. Отложенное
+        # обновление могло дождаться удаления топика — тогда не пересоздаём его
         if chat_id not in active_topics_info:
             return
 
-        topic_id = active_topics_info[chat_id]['topic_id']
-        message_id = active_topics_info[chat_id]['message_id']
-
         # Формируем текст сообщения
         if chat_id in active_topics and active_topics[chat_id]:
-            text = "Темы в которых нужен номер:\n"
-            chat = await bot.get_chat(chat_id)
-
+            chat = await get_chat_info(chat_id, bot)
+            lines = []
             for active_topic_id in active_topics[chat_id]:
-                topic_name = topics_dict.get(chat_id, {}).get(active_topic_id, f"Тема {active_topic_id}")
-
-                # Вычисляем время простоя
-                activation_time = sos_activation_times.get((chat_id, active_topic_id))
-                if activation_time:
-                    elapsed_seconds = int(time.time() - activation_time)
-                    if elapsed_seconds < 60:
-                        time_str = f"({elapsed_seconds} секунд простой)"
-                    else:
-                        minutes = elapsed_seconds // 60
-                        seconds = elapsed_seconds % 60
-                        if seconds > 0:
-                            time_str = f"({minutes} минут {seconds} секунд простой)"
-                        else:
-                            time_str = f"({minutes} минут простой)"
-                else:
-                    time_str = "(время неизвестно)"
-
-                # Создаем ссылку на топик
-                if chat.username:
-                    link = f"https://t.me/{chat.username}/{active_topic_id}"
-                else:
-                    # Для приватных чатов используем другой формат
-                    link = f"https://t.me/c/{str(chat_id)[4:]}/{active_topic_id}"
-
-                text += f"• {topic_name} {time_str} - {link}\n"
+                prefix, suffix = _dashboard_line_parts(chat_id, chat, active_topic_id)
+                idle_time = format_idle_time(sos_activation_times.get((chat_id, active_topic_id)))
+                lines.append(prefix + idle_time + suffix)
+            shards = split_dashboard("Темы в которых нужен номер:\n", lines)
         else:
-            text = "Темы в которых нужен номер:\n(пока нет активных тем)"
-
-        # Обновляем сообщение
-        await bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=message_id,
-            text=text,
-            disable_web_page_preview=True
-        )
+            shards = ["Темы в которых нужен номер:\n(пока нет активных тем)"]
+
+        await _sync_dashboard_shards(chat_id, shards, bot)
 
         logging.info(f"Обновлено сообщение в топике 'Активные темы' для чата {chat_id}")
 
     except Exception as e:
         logging.error(f"Ошибка при обновлении сообщения 'Активные темы': {str(e)}")
 
-async def auto_remove_sos(chat_id: int, topic_id: int, bot: Bot):
-    """Автоматически снимает SOS через 5 минут"""
-    try:
-        await asyncio.sleep(300)  # 5 минут = 300 секунд
-
-        # Проверяем, активен ли ещё SOS
-        if (chat_id in active_topics and 
-            topic_id in active_topics[chat_id]):
-
-            logging.info(f"Автоматическое снятие SOS для темы {topic_id} в чате {chat_id}")
+def remove_active_topic(chat_id: int, topic_id: int) -> bool:
+    """Убирает тему из активных SOS. Возвращает True, если тема была активной"""
+    if chat_id not in active_topics or topic_id not in active_topics[chat_id]:
+        return False
 
-            # Убираем тему из активных
-            active_topics[chat_id].remove(topic_id)
-            if not active_topics[chat_id]:
-                del active_topics[chat_id]
+    active_topics[chat_id].remove(topic_id)
+    if not active_topics[chat_id]:
+        del active_topics[chat_id]
+
+    sos_activation_times.pop((chat_id, topic_id), None)
+    _dashboard_line_cache.pop((chat_id, topic_id), None)
+    return True
+
+class SosExpiryScheduler:
+    """Единый планировщик автоснятия SOS.
+
+    Дедлайны всех тем лежат в одной куче, а истёкшие обрабатывает один цикл.
+    Продление SOS добавляет в кучу новую запись за O(log n); старая запись
+    остаётся в куче и пропускается, когда до неё доходит очередь.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._bot = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, chat_id: int, topic_id: int, delay: float, bot: Bot):
+        """Назначить (или продлить) автоснятие SOS в теме через delay секунд"""
+        key = (chat_id, topic_id)
+        deadline = time.monotonic() + delay
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        self._bot = bot
+
+        # Слишком много устаревших записей — пересобираем кучу
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(d, k) for k, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        elif self._heap[0][1] == key:
+            # Новый дедлайн раньше всех остальных — будим цикл
+            self._wakeup.set()
+
+    def cancel(self, chat_id: int, topic_id: int):
+        """Отменить автоснятие SOS в теме"""
+        self._deadlines.pop((chat_id, topic_id), None)
+
+    def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def _pop_expired(self) -> list:
+        now = time.monotonic()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, key = heapq.heappop(self._heap)
+            if self._deadlines.get(key) != deadline:
+                continue  # SOS был продлён или отменён
+            del self._deadlines[key]
+            expired.append(key)
+        return expired
+
+    async def _run(self):
+        try:
+            while True:
+                changed_chats = set()
+                for chat_id, topic_id in self._pop_expired():
+                    if remove_active_topic(chat_id, topic_id):
+                        logging.info(f"Автоматическое снятие SOS для темы {topic_id} в чате {chat_id}")
+                        changed_chats.add(chat_id)
+
+                # Обновляем сообщение в активных темах
+                for chat_id in changed_chats:
+                    request_dashboard_update(chat_id, self._bot)
+
+                timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            logging.info("Планировщик автоснятия SOS остановлен")
+        except Exception as e:
+            logging.error(f"Ошибка в планировщике автоснятия SOS: {str(e)}")
+
+sos_expiry = SosExpiryScheduler()
+
+def forget_topic(chat_id: int, topic_id: int, bot: Bot):
+    """Убрать удалённую тему из всех словарей бота, включая активные SOS"""
+    if chat_id in topics_dict:
+        topics_dict[chat_id].pop(topic_id, None)
+        mark_dirty('topics', chat_id)
+    if chat_id in workers_dict:
+        workers_dict[chat_id].pop(topic_id, None)
+        mark_dirty('workers', chat_id)
+    if chat_id in rename_topics_dict:
+        rename_topics_dict[chat_id].discard(topic_id)
+        mark_dirty('rename_topics', chat_id)
+    if chat_id in restricted_topics:
+        restricted_topics[chat_id].pop(topic_id, None)
+        if not restricted_topics[chat_id]:
+            del restricted_topics[chat_id]
+        mark_dirty('restricted_topics', chat_id)
+
+    info = active_topics_info.get(chat_id)
+    if info is not None and info['topic_id'] == topic_id:
+        # Удалена сама тема 'Активные темы' — при следующем SOS создастся новая
+        del active_topics_info[chat_id]
+        mark_dirty('active_topics_info', chat_id)
+    if _dashboard_unsent.get(chat_id) == topic_id:
+        del _dashboard_unsent[chat_id]
+        _dashboard_hashes.pop(chat_id, None)
+
+    if remove_active_topic(chat_id, topic_id):
+        sos_expiry.cancel(chat_id, topic_id)
+        if chat_id in active_topics_info:
+            request_dashboard_update(chat_id, bot)
 
-            # Убираем время активации
-            if (chat_id, topic_id) in sos_activation_times:
-                del sos_activation_times[(chat_id, topic_id)]
+_ticker_task = None
 
-            # Обновляем сообщение в активных темах
-            await update_active_topics_message(chat_id, bot)
+def ensure_dashboard_ticker(bot: Bot):
+    """Запустить общий цикл обновления времени простоя, если он не запущен"""
+    global _ticker_task
+    if _ticker_task is None or _ticker_task.done():
+        _ticker_task = asyncio.create_task(dashboard_ticker(bot))
 
-        # Убираем задачу из словаря
-        if (chat_id, topic_id) in sos_removal_tasks:
-            del sos_removal_tasks[(chat_id, topic_id)]
+def stop_dashboard_ticker():
+    if _ticker_task is not None and not _ticker_task.done():
+        _ticker_task.cancel()
 
-    except asyncio.CancelledError:
-        logging.info(f"Задача автоснятия SOS отменена для темы {topic_id}")
-    except Exception as e:
-        logging.error(f"Ошибка в auto_remove_sos: {str(e)}")
+async def dashboard_ticker(bot: Bot):
+    """Обновляет время простоя во всех чатах с активными SOS одним циклом.
 
-async def update_sos_times(chat_id: int, bot: Bot):
-    """Обновляет время простоя каждые 30 секунд"""
+    Обновления чатов равномерно распределены по SOS_REFRESH_INTERVAL, но идут
+    не чаще DASHBOARD_TICKER_MAX_RATE в секунду, чтобы не выбрать общий лимит API.
+    Цикл завершается, когда активных SOS не остаётся.
+    """
     try:
-        while chat_id in active_topics and active_topics[chat_id]:
-            await asyncio.sleep(30)  # Обновляем каждые 30 секунд
-            if chat_id in active_topics and active_topics[chat_id]:
-                await update_active_topics_message(chat_id, bot)
-
-        # Убираем задачу из словаря когда нет активных тем
-        if chat_id in sos_update_tasks:
-            del sos_update_tasks[chat_id]
+        while True:
+            chats = [chat_id for chat_id, topics in active_topics.items() if topics]
+            if not chats:
+                break
+
+            bot_stats['ticker_ticks'] += 1
+            bot_stats['ticker_last_chats'] = len(chats)
+            bot_stats['ticker_chats_total'] += len(chats)
+
+            tick_started = time.monotonic()
+            step = max(SOS_REFRESH_INTERVAL / len(chats), 1 / DASHBOARD_TICKER_MAX_RATE)
+            for i, chat_id in enumerate(chats):
+                delay = tick_started + (i + 1) * step - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if active_topics.get(chat_id):
+                    request_dashboard_update(chat_id, bot)
 
     except asyncio.CancelledError:
-        logging.info(f"Задача обновления времени SOS отменена для чата {chat_id}")
+        logging.info("Цикл обновления времени SOS остановлен")
     except Exception as e:
-        logging.error(f"Ошибка в update_sos_times: {str(e)}")
+        logging.error(f"Ошибка в dashboard_ticker: {str(e)}")
 
 async def schedule_break_notification(time_str: str, message_text: str, bot: Bot):
     """Планировать уведомление о перерыве"""
@@ -290,20 +923,17 @@ async def schedule_break_notification(time_str: str, message_text: str, bot: Bot
 async def send_break_notification_to_all_topics(message_text: str, bot: Bot):
     """Отправить уведомление о перерыве во все топики"""
     try:
-        for chat_id, topics in topics_dict.items():
-            for topic_id in topics.keys():
-                try:
-                    await bot.send_message(
-                        chat_id=chat_id,
-                        message_thread_id=topic_id,
-                        text=f"☕ {message_text}"
-                    )
-                    # Небольшая задержка между отправками
-                    await asyncio.sleep(0.1)
-                except Exception as e:
-                    logging.error(f"Ошибка при отправке уведомления о перерыве в топик {topic_id}: {str(e)}")
-
-        logging.info(f"Уведомление о перерыве отправлено во все топики: {message_text}")
+        targets = [
+            (chat_id, topic_id)
+            for chat_id, topics in topics_dict.items()
+            for topic_id in topics
+        ]
+        report = await outbox.broadcast(bot, targets, f"☕ {message_text}")
+        logging.info(
+            f"Уведомление о перерыве отправлено в {report['sent']} из {report['total']} топиков "
+            f"({report['chats']} чатов) за {report['elapsed']:.1f} с, "
+            f"повторов: {report['retried']}, ошибок: {report['failed']}: {message_text}"
+        )
 
     except Exception as e:
         logging.error(f"Ошибка при отправке уведомлений о перерыве: {str(e)}")
@@ -327,3 +957,4 @@ async def schedule_break_tasks(break_id: int, break_data: dict, bot: Bot):
 
 # Initialize PC database
 init_pc_database()
+pc_pool.load()